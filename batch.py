@@ -0,0 +1,69 @@
+'''
+Evaluation of many terms over many points with a pool of processes.
+The terms (e.g. all components of a vect or matrix) are sent to every
+worker process once, when the pool starts, the points are then sent
+in chunks. Each worker evaluates all terms on its chunk in one pass
+with array_eval from evaluation.py, sharing one memo between the terms,
+so subterms common to several terms are evaluated once per chunk.
+'''
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from expression import *
+from evaluation import as_arrays, array_eval
+
+#the terms of a worker process, set once by init_worker
+worker_terms = []
+
+def eval_many(terms: list, points: dict, workers: int = None, chunk: int = 10000) -> np.ndarray:
+    '''
+    Evaluates every term in terms at every point.
+    points is a dict {'variable': array} as for calc_eval_array,
+    the arrays are broadcast against each other and the points are
+    taken in the (flat) order of the broadcast shape.
+    All variables of the terms have to be provided.
+    workers is the number of processes, default os.cpu_count(),
+    with workers = 1 everything is evaluated in this process.
+    chunk is the number of points sent to a worker at a time.
+    Returns an ndarray of shape (len(terms), number of points),
+    with the same values as calc_eval_array of each term.
+    '''
+    arrays, shape = as_arrays(points)
+    n = int(np.prod(shape))
+    flat = {key: np.broadcast_to(arr, shape).reshape(-1) for key, arr in arrays.items()}
+    starts = range(0, n, chunk)
+    chunks = ({key: arr[start:start + chunk] for key, arr in flat.items()} for start in starts)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    res = np.empty((len(terms), n))
+    if workers <= 1 or n <= chunk:
+        init_worker(terms)
+        results = map(eval_chunk, chunks)
+        for start, values in zip(starts, results):
+            res[:, start:start + chunk] = values
+        return res
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(terms,)) as pool:
+        for start, values in zip(starts, pool.map(eval_chunk, chunks)):
+            res[:, start:start + chunk] = values
+    return res
+
+def init_worker(terms: list):
+    '''
+    Stores the terms in the worker process.
+    '''
+    global worker_terms
+    worker_terms = terms
+
+def eval_chunk(vars: dict) -> np.ndarray:
+    '''
+    Evaluates the terms of the worker on one chunk of points,
+    returns an ndarray of shape (number of terms, number of points in the chunk).
+    '''
+    arrays, shape = as_arrays(vars)
+    memo = {}
+    res = np.empty((len(worker_terms),) + shape)
+    for i, term in enumerate(worker_terms):
+        #constant terms come back as scalars and are broadcast here
+        res[i] = array_eval(term, arrays, memo)
+    return res
@@ -0,0 +1,111 @@
+'''
+Stress benchmarks for the scaling of the library.
+Run as a script: python benchmarks.py
+Each benchmark prints a table of input sizes and timings.
+For linear scaling the time per unit (last column) stays roughly constant
+while the size doubles.
+'''
+import gc
+import sys
+import time
+from parsing import *
+from evaluation import *
+from derivatives import *
+
+
+def best_time(fct, *args, repeat: int = 3) -> float:
+    '''
+    Best wall clock time of repeat calls of fct(*args) in seconds.
+    Collects garbage before every call, so that no nodes of the previous call
+    are still in the hash consing table of myexpr.
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fct(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def wide_sum(n: int) -> str:
+    '''
+    Sum of n monomials in two variables with distinct coefficients,
+    like a generated polynomial chaos expansion.
+    '''
+    return ' + '.join(f'{i + 1}.5*x**{i % 7}*y**{i % 5}' for i in range(n))
+
+def deep_nesting(n: int) -> str:
+    '''
+    n nested brackets, alternating sums, products and special functions,
+    e.g. sin((cos((x + 1)*2) + 1)*2)
+    '''
+    fcts = ['sin', 'cos', 'exp']
+    s = 'x'
+    for i in range(n):
+        if i % 3 == 2:
+            s = f'{fcts[i % len(fcts)]}({s})'
+        else:
+            s = f'({s} + 1)*2'
+    return s
+
+def report(title: str, unit: str, rows: list):
+    '''
+    Prints the rows (size, units, seconds) as a table.
+    '''
+    print(title)
+    print(f'{"size":>10} {unit:>10} {"seconds":>10} {"us/" + unit:>10}')
+    for size, units, secs in rows:
+        print(f'{size:>10} {units:>10} {secs:>10.4f} {1e6*secs/units:>10.3f}')
+    print()
+
+def bench_parsing(sizes: list = [1000, 2000, 4000, 8000, 16000]):
+    '''
+    Parse time of wide sums and deeply nested expressions
+    of the given sizes (number of terms, nesting depth).
+    '''
+    for title, gen in [('parsing: wide sums', wide_sum), ('parsing: deep nesting', deep_nesting)]:
+        rows = []
+        for n in sizes:
+            s = gen(n)
+            rows.append((n, len(s), best_time(my_parser, ['x', 'y'], s)))
+        report(title, 'char', rows)
+
+def build_chain(n: int) -> myexpr:
+    '''
+    Left-leaning sum of n products, as built by vect_dot_prod.
+    '''
+    res = myexpr('mul', myexpr('const', '0'), myexpr('id', 'x'))
+    for i in range(1, n):
+        res = myexpr('add', res, myexpr('mul', myexpr('const', str(i)), myexpr('id', 'x')))
+    return res
+
+def bench_deep(sizes: list = [12500, 25000, 50000, 100000, 200000]):
+    '''
+    Construction, evaluation, differentiation and printing of chains of n terms,
+    i.e. terms of depth n.
+    '''
+    rows = {'construction': [], 'calc_eval': [], 'calc_diff': [], 'str': []}
+    for n in sizes:
+        gc.collect()
+        start = time.perf_counter()
+        term = build_chain(n)
+        rows['construction'].append((n, n, time.perf_counter() - start))
+        rows['calc_eval'].append((n, n, best_time(calc_eval, term, {'x': 0.5}, repeat=1)))
+        diff_cache.clear()
+        rows['calc_diff'].append((n, n, best_time(calc_diff, term, 'x', repeat=1)))
+        start = time.perf_counter()
+        str(term)
+        rows['str'].append((n, n, time.perf_counter() - start))
+        del term
+    for title, table in rows.items():
+        report(f'deep chains: {title}', 'term', table)
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]]
+    if sizes:
+        bench_parsing(sizes)
+        bench_deep(sizes)
+    else:
+        bench_parsing()
+        bench_deep()
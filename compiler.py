@@ -0,0 +1,275 @@
+'''
+Compiles myexpr terms into flat python functions.
+Instead of walking the tree (one python frame per node per call)
+the term is lowered once into straight-line source code with one
+temporary per node, e.g. for sin(x)*x + 2:
+
+    def compiled(v0):
+        t0 = sin(v0)
+        t1 = t0 * v0
+        del t0
+        t2 = t1 + 2.0
+        del t1
+        return t2
+
+Every temporary is deleted right after its last use, so for arrays
+the memory needed is not one array per node but the largest number of
+temporaries alive at the same time (see gen_source), e.g. 3 for a sum
+of any number of terms sin(x) + sin(2*x) + ...
+The special functions are the numpy ufuncs, so the resulting function
+works for floats and ndarrays alike.
+The compiled function is cached on the term, keyed by the variable list.
+'''
+import re
+import numpy as np
+from expression import *
+
+#namespace the generated code is executed in
+namespace = {'exp': np.exp, 'sin': np.sin, 'cos': np.cos, 'tan': np.tan, 'log': np.log, 'power': np.power}
+#names of the temporaries: t for values, d for tangents (see gen_grad_source)
+temporary_re = re.compile(r'\b[td]\d+\b')
+
+def calc_compile(term: myexpr, vars: list):
+    '''
+    Compiles a term into a function of the variables in vars, e.g.
+    f = calc_compile(term, ['x','y'])
+    f(1.0, 2.0) or f(x_array, y_array)
+    The arguments are positional and in the order of vars.
+    All variables of the term have to be in vars.
+    '''
+    key = tuple(vars)
+    cache = getattr(term, 'compiled', None)
+    if cache is None:
+        cache = {}
+        term.compiled = cache
+    if key not in cache:
+        cache[key] = build_function(term, key)
+    return cache[key]
+
+def calc_compile_grad(term: myexpr, vars: list, wrt: list):
+    '''
+    Compiles the gradient of a term w.r.t. the variables in wrt into a function
+    of the variables in vars (positional, in the order of vars), e.g.
+    g = calc_compile_grad(term, ['x','y'], ['x'])
+    g(x_array, y_array) -> [d(term)/dx]
+    Returns a list with one partial derivative per variable in wrt,
+    see gen_grad_source. Cached on the term like calc_compile.
+    '''
+    key = (tuple(vars), tuple(wrt))
+    cache = getattr(term, 'compiled', None)
+    if cache is None:
+        cache = {}
+        term.compiled = cache
+    if key not in cache:
+        cache[key] = build_function(term, *key)
+    return cache[key]
+
+def build_function(term: myexpr, vars: tuple, wrt: tuple = None):
+    '''
+    Generates the source code of the function with gen_source
+    (with gen_grad_source if wrt is given),
+    executes it and returns the function object.
+    The source is kept in the attribute 'source' of the function.
+    '''
+    src = gen_source(term, vars) if wrt is None else gen_grad_source(term, vars, wrt)
+    scope = dict(namespace)
+    exec(compile(src, f'<compiled {term.op}>', 'exec'), scope)
+    fct = scope['compiled']
+    fct.source = src
+    return fct
+
+def literal(val: float) -> str:
+    '''
+    Source code for a constant. Negative numbers are bracketed,
+    so they stay one operand whatever operator they are next to.
+    '''
+    if not np.isfinite(val):
+        return f"float('{val}')"
+    if val < 0:
+        return f'({val!r})'
+    return repr(val)
+
+def gen_source(term: myexpr, vars: tuple) -> str:
+    '''
+    Lowers the term into source code.
+    Goes through the nodes in post order (children before parents)
+    using an explicit stack, so deep terms don't hit the recursion limit.
+    Nodes that are shared between parents get only one temporary.
+    Constants are inlined as literals, variables are the arguments v0, v1, ...
+    Each temporary is deleted (del) after the last line that uses it, so at any
+    time only the temporaries still needed later are alive. The children are
+    computed left before right, a term nested deeply on the left side like
+    ((a + b) + c) + d needs few temporaries, one nested on the right side
+    a + (b + (c + d)) keeps one alive for each level of nesting.
+    '''
+    args = arg_names(vars)
+    names = {}
+    #(temporary, code)
+    lines = []
+    stack = [(term, False)]
+    while stack:
+        node, visited = stack.pop()
+        if id(node) in names:
+            continue
+        if node.op in ('id', 'const'):
+            names[id(node)] = leaf(node, args, vars)
+            continue
+        if not visited:
+            #first visit: process the children first
+            stack.append((node, True))
+            if node.right is not None:
+                stack.append((node.right, False))
+            stack.append((node.left, False))
+            continue
+        left = names[id(node.left)]
+        right = names[id(node.right)] if node.right is not None else None
+        tmp = f't{len(lines)}'
+        lines.append((tmp, value_code(node.op, left, right)))
+        names[id(node)] = tmp
+    return assemble(args, lines, names[id(term)], [names[id(term)]])
+
+def gen_grad_source(term: myexpr, vars: tuple, wrt: tuple) -> str:
+    '''
+    Lowers the gradient of the term w.r.t. the variables in wrt into source code,
+    in forward mode: every node gets its value and one tangent
+    d(node)/d(variable) per variable in wrt, computed from the values and tangents
+    of its children, e.g. for sin(x)*y w.r.t. x:
+
+        def compiled(v0, v1):
+            d1 = cos(v0) * 1.0
+            d3 = d1 * v1
+            del d1
+            return [d3]
+
+    Tangents of nodes that don't depend on a variable are structurally zero
+    and not computed, values and tangents that no derivative needs are left out
+    (above the values of sin(x) and sin(x)*y, the value of the term is not returned).
+    The temporaries are deleted after their last use as in gen_source, so unlike
+    reverse mode (see sweep in reverse.py), which keeps the value of every node
+    for the backward sweep, only the temporaries still needed later are alive,
+    at the price of one tangent per variable for every node.
+    '''
+    args = arg_names(vars)
+    names = {}
+    tangents = {}
+    lines = []
+
+    def new(prefix, code):
+        tmp = f'{prefix}{len(lines)}'
+        lines.append((tmp, code))
+        return tmp
+
+    for node in postorder(term):
+        if node.op in ('id', 'const'):
+            names[id(node)] = leaf(node, args, vars)
+            tangents[id(node)] = [('1.0' if node.op == 'id' and node.left == var else None) for var in wrt]
+            continue
+        a = names[id(node.left)]
+        b = names[id(node.right)] if node.right is not None else None
+        t = new('t', value_code(node.op, a, b))
+        names[id(node)] = t
+        res = []
+        for da, db in zip(tangents[id(node.left)], tangents[id(node.right)] if b is not None else [None]*len(wrt)):
+            terms = tangent_terms(node.op, t, a, b, da, db)
+            if not terms:
+                res.append(None)
+            elif node.op == 'add' and len(terms) == 1:
+                #the tangent of the other summand is zero
+                res.append(terms[0])
+            else:
+                res.append(new('d', ' + '.join(terms)))
+        tangents[id(node)] = res
+    results = [name if name is not None else '0.0' for name in tangents[id(term)]]
+    return assemble(args, lines, f'[{", ".join(results)}]', results)
+
+def tangent_terms(op: str, t: str, a: str, b: str, da: str, db: str) -> list:
+    '''
+    Summands of the tangent of a node with value t, whose children have the values a, b
+    and the tangents da, db (None if zero). Same rules as in reverse.py.
+    '''
+    res = []
+    if op == 'add':
+        res = [d for d in (da, db) if d is not None]
+    elif op == 'mul':
+        if da is not None:
+            res.append(f'{da} * {b}')
+        if db is not None:
+            res.append(f'{a} * {db}')
+    elif op == 'pwr':
+        if da is not None:
+            res.append(f'{b} * power({a}, {b} - 1) * {da}')
+        if db is not None:
+            res.append(f'{t} * log({a}) * {db}')
+    elif da is not None:
+        res.append(tangent_cases[op].format(t=t, a=a, da=da))
+    return res
+
+#tangents of the special functions
+tangent_cases = {
+        'exp': '{t} * {da}', 'sin': 'cos({a}) * {da}', 'cos': '-sin({a}) * {da}',
+        'tan': '{da} / cos({a}) ** 2', 'log': '{da} / {a}'
+        }
+
+def arg_names(vars: tuple) -> dict:
+    '''
+    Names of the arguments of a compiled function, v0, v1, ... in the order of vars.
+    '''
+    return {v: f'v{i}' for i, v in enumerate(vars)}
+
+def leaf(node: myexpr, args: dict, vars: tuple) -> str:
+    '''
+    Source code for a variable (its argument) or a constant (a literal).
+    '''
+    if node.op == 'const':
+        return literal(float(node.left))
+    if node.left not in args:
+        raise Exception(f'Variable "{node.left}" is not in the list of variables {list(vars)}.')
+    return args[node.left]
+
+def value_code(op: str, left: str, right: str) -> str:
+    '''
+    Source code for the value of a node from the values of its children.
+    '''
+    if op == 'add':
+        return f'{left} + {right}'
+    if op == 'mul':
+        return f'{left} * {right}'
+    if op == 'pwr':
+        #np.power instead of **, so floats give inf and nan like arrays, e.g. 0^(-2)
+        return f'power({left}, {right})'
+    #special functions are named after their tag
+    return f'{op}({left})'
+
+def assemble(args: dict, lines: list, ret: str, results: list) -> str:
+    '''
+    Source code of the function from the lines (temporary, code),
+    returning ret, which uses the names in results.
+    Lines whose temporary is not needed for the results are left out and
+    every temporary is deleted (del) right after the last line that uses it.
+    '''
+    #backwards: which lines are needed and where each temporary is used last
+    needed = set(results)
+    last = {}
+    kept = []
+    for i in reversed(range(len(lines))):
+        tmp, code = lines[i]
+        if tmp not in needed:
+            continue
+        kept.append(i)
+        for name in temporary_re.findall(code):
+            if name not in needed:
+                needed.add(name)
+                last[name] = i
+    dead = {}
+    for name, i in last.items():
+        if name not in results:
+            dead.setdefault(i, []).append(name)
+    body = []
+    for i in reversed(kept):
+        tmp, code = lines[i]
+        body.append(f'{tmp} = {code}')
+        if i in dead:
+            body.append(f'del {", ".join(sorted(dead[i]))}')
+    body.append(f'return {ret}')
+    head = f'def compiled({", ".join(args.values())}):'
+    return '\n'.join([head] + ['    ' + line for line in body]) + '\n'
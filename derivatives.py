@@ -5,35 +5,143 @@ cases = {'name of operation': corresponding callable function}
 e.g.
 term = myexpr('add', left, right)
 -> cases = {'add': diff_add} 
--> derivative(term) calls cases[term.op](term.left, term.right)
+-> derivative(term) calls cases[term.op](term, var, memo)
 -> diff_add returns myexpr('add',derivative(term.left), derivative(term.right))
+where the derivatives of the children are already in memo.
 '''
 
 #import atoms as at
 import numpy as np
+from collections import OrderedDict
 from expression import *
+from simplification import calc_simplify
 
 ################## functions calculating derivatives #########################
 
-def calc_diff(term: myexpr, var = None) -> myexpr:
+def calc_diff(term: myexpr, var = None, memo: dict = None, simplify: bool = False) -> myexpr:
     '''
     Recieves a term and calculates the partial derivative using the functions defined below
     and the dict with cases, defined at the end of the document.
     Var is the variabel w.r.t. which the derivative is to be taken.
     Default is None which is taken to be 'x', else input string, e.g.
     calc_diff(TERM, 'y')
-    '''
-    return cases[term.op](term,var)
+    memo maps id(node) -> derivative and is created per call, so subterms shared
+    by several parents are differentiated once and the result is a DAG as well.
+    With simplify=True the result is simplified with calc_simplify, e.g.
+    calc_diff(TERM, 'y', simplify=True)
+    Every derivative is also stored in diff_cache, so the same subterms
+    are not differentiated again in later calls.
+    Subterms that don't depend on var (see calc_vars in expression.py)
+    are not traversed, their derivative is the constant 0.
+    The term is traversed with an explicit stack, children before parents,
+    so the functions below find the derivatives of the children in memo
+    and there is no recursion, no matter how deep the term is.
+    '''
+    if simplify:
+        res = diff_cache.get(term, var, True)
+        if res is None:
+            res = calc_simplify(calc_diff(term,var,memo))
+            diff_cache.put(term, var, True, res)
+        return res
+    if memo is None:
+        memo = {}
+    stack = [(term, False)]
+    while stack:
+        node, visited = stack.pop()
+        key = id(node)
+        if key in memo:
+            continue
+        if not visited:
+            if var not in calc_vars(node):
+                #structurally zero, no need to go into the subterm
+                memo[key] = myexpr('const', '0')
+                continue
+            res = diff_cache.get(node, var)
+            if res is not None:
+                #no need to go into the subterm
+                memo[key] = res
+                continue
+            stack.append((node, True))
+            if node.op not in ('id', 'const'):
+                if node.right is not None:
+                    stack.append((node.right, False))
+                stack.append((node.left, False))
+            continue
+        res = cases[node.op](node,var,memo)
+        diff_cache.put(node, var, False, res)
+        memo[key] = res
+    return memo[id(term)]
+
+class derivative_cache:
+    '''
+    Bounded LRU cache of derivatives, keyed by (term, variable, simplified).
+    Since myexpr is hash consed the node itself is a structural key,
+    i.e. any term with the same structure hits the same entry.
+    maxsize = 0 switches the cache off.
+    '''
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, term: myexpr, var, simplified: bool = False):
+        '''
+        Returns the cached derivative or None.
+        '''
+        key = (term, var, simplified)
+        res = self.entries.get(key)
+        if res is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return res
+
+    def put(self, term: myexpr, var, simplified: bool, res: myexpr):
+        '''
+        Stores a derivative, drops the least recently used entries if full.
+        '''
+        if self.maxsize <= 0:
+            return
+        self.entries[(term, var, simplified)] = res
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def resize(self, maxsize: int):
+        '''
+        Sets a new maximal number of entries.
+        '''
+        self.maxsize = maxsize
+        while len(self.entries) > max(maxsize, 0):
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        '''
+        Drops all entries and resets the statistics.
+        '''
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self) -> dict:
+        '''
+        Hit/miss statistics and size of the cache.
+        '''
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'maxsize': self.maxsize}
+
+#the cache used by calc_diff
+diff_cache = derivative_cache()
 
 ############### derivatives of id, const, special fcts ##############
 
-def diff_const(term: myexpr, var = None) -> myexpr:
+def diff_const(term: myexpr, var = None, memo = None) -> myexpr:
     '''
     Derivative of constant = 0
     '''
     return myexpr('const', '0')
 
-def diff_id(term: myexpr, var = None) -> myexpr:
+def diff_id(term: myexpr, var = None, memo = None) -> myexpr:
     '''
     Derivative of the identity = 1.
     Checks if it's the desired variable.
@@ -44,56 +152,61 @@ def diff_id(term: myexpr, var = None) -> myexpr:
     else:
         return myexpr('const', '0')
 
-def diff_add(term: myexpr, var = None) -> myexpr:
+def diff_add(term: myexpr, var = None, memo = None) -> myexpr:
     '''
     Derivative of sum: (x+y)'= x' + y'
     '''
-    return myexpr('add',calc_diff(term.left,var), calc_diff(term.right,var))
+    return myexpr('add',memo[id(term.left)], memo[id(term.right)])
 
-def diff_mul(term: myexpr, var = None) -> myexpr:
+def diff_mul(term: myexpr, var = None, memo = None) -> myexpr:
     '''
     Derivative of product: (x*y)'= (x')*y + x(y')
     '''
-    return myexpr('add', myexpr('mul', calc_diff(term.left,var), term.right), myexpr('mul', term.left, calc_diff(term.right,var)))
+    return myexpr('add', myexpr('mul', memo[id(term.left)], term.right), myexpr('mul', term.left, memo[id(term.right)]))
 
-def diff_pwr(term: myexpr, var = None) -> myexpr:
+def diff_pwr(term: myexpr, var = None, memo = None) -> myexpr:
     '''
-    Derivative of x^n: (x^n)' = n*x^(n-1)
-    for clarity the new exponent is calculated first,
-    assumes the exponent is constant
+    Derivative of x^n: (x^n)' = n*x^(n-1)*(x')
+    the new exponent is the term n + (-1), which calc_simplify folds.
+    If the exponent depends on var the general rule
+    (f^g)' = f^g*((g')*log(f) + g*(f')*f^(-1)) is used.
     '''
-    newp = str(term.power.eval(1)-1)
-    return myexpr('mul', myexpr('const',term.power),myexpr('pwr',myexpr('id'),myexpr('const',newp)))
+    base, exponent = term.left, term.right
+    if var not in calc_vars(exponent):
+        newp = myexpr('add',exponent,myexpr('const','-1'))
+        return myexpr('mul',myexpr('mul',exponent,myexpr('pwr',base,newp)),memo[id(base)])
+    return myexpr('mul',term,myexpr('add',myexpr('mul',memo[id(exponent)],myexpr('log',base)),
+                                    myexpr('mul',exponent,myexpr('mul',memo[id(base)],myexpr('pwr',base,myexpr('const','-1'))))))
 
-def diff_exp(term: myexpr, var = None) -> myexpr:
+def diff_exp(term: myexpr, var = None, memo = None) -> myexpr:
     '''
     Derivative of exponential fct: exp(x)'= exp(x)*(x')
     '''
-    return myexpr('mul',calc_diff(term.left,var),term)
+    return myexpr('mul',memo[id(term.left)],term)
 
-def diff_sin(term: myexpr, var = None) -> myexpr:
+def diff_sin(term: myexpr, var = None, memo = None) -> myexpr:
     '''
     Deravitve of sine: cosine
     '''
-    return myexpr('mul',myexpr('cos',term.left),calc_diff(term.left,var))
+    return myexpr('mul',myexpr('cos',term.left),memo[id(term.left)])
 
-def diff_cos(term: myexpr, var = None) -> myexpr:
+def diff_cos(term: myexpr, var = None, memo = None) -> myexpr:
     '''
     Derivative of cosine: -sine
     '''
-    return myexpr('mul',myexpr('const','-1',None),myexpr('mul',myexpr('sin',term.left),calc_diff(term.left,var)))
+    return myexpr('mul',myexpr('const','-1',None),myexpr('mul',myexpr('sin',term.left),memo[id(term.left)]))
 
-def diff_tan(term: myexpr, var = None) -> myexpr:
+def diff_tan(term: myexpr, var = None, memo = None) -> myexpr:
     '''
     Derivative of tangent: sec^2=1/cos^2
     '''
-    return myexpr('mul',myexpr('pwr',myexpr('cos'),myexpr('const','-2')),calc_diff(term.left,var))
+    return myexpr('mul',myexpr('pwr',myexpr('cos',term.left),myexpr('const','-2')),memo[id(term.left)])
 
-def diff_log(term: myexpr, var = None) -> myexpr:
+def diff_log(term: myexpr, var = None, memo = None) -> myexpr:
     '''
     Derivative of natural log: (arg'/arg)
     '''
-    return myexpr('mul',calc_diff(term.left,var),myexpr('pwr',term.left,myexpr('const','-1')))
+    return myexpr('mul',memo[id(term.left)],myexpr('pwr',term.left,myexpr('const','-1')))
 
 
 
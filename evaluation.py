@@ -3,12 +3,19 @@ Analogous to derivatives.py.
 Evaluates myexpr term w.r.t. given variable.
 If a variable is not to be evaluated it returns the string of that variable.
 All functions then check is an argument is a string.
+
+calc_partial_eval substitutes only some of the variables and stays in the
+tree domain: it returns a new myexpr, in which all subterms that no longer
+contain a variable are folded into constants.
+
+calc_eval_array is the batch version: it takes whole arrays of points
+and evaluates every node once with numpy ufuncs (see array_cases at the end).
 '''
 import numpy as np
 from expression import *
 
 
-def calc_eval(term: myexpr, vars: dict):
+def calc_eval(term: myexpr, vars: dict, memo: dict = None):
     '''
     Evaluates a term using the functions defined below
     and the dict with cases, defined at the end of the document.
@@ -16,31 +23,45 @@ def calc_eval(term: myexpr, vars: dict):
     where the value is a float. Multiple variables can be given.
     If a variable is not provided with a value all others are evaluated
     and the result is a string.
+    memo maps id(node) -> value and is created per call, so subterms shared
+    by several parents (see hash consing in expression.py) are evaluated once.
+    The nodes are evaluated in post order (see term_order() in expression.py,
+    which is kept on the term), so the functions below find the values of the children
+    in memo and there is no recursion, no matter how deep the term is.
     '''
-    return cases[term.op](term,vars)
+    if memo is None:
+        if vars.keys() >= calc_vars(term):
+            #all variables are given, so there are no strings: one pass over the plan of the term
+            return plan_eval(term, {name: as_value(vars[name]) for name in term.deps})
+        memo = {}
+    for node in term_order(term):
+        key = id(node)
+        if key not in memo:
+            memo[key] = code_cases[node.code](node,vars,memo)
+    return memo[id(term)]
 
 ########################### basic evals: constants, id ##################################
-def eval_const(term, vars):
+def eval_const(term, vars, memo):
     #const always gives it's assigned num const as worth
-    #so the aergument of self.worth() is irrelevant    
-    return term.worth(0)
+    return float(term.left)
 
-def eval_id(term, vars):
+def eval_id(term, vars, memo):
     '''
     Checks whether the variable is to be evaluated.
     If not, returns the string.
+    Arrays of values are used as they are (see as_value in expression.py).
     '''
-    if term.left in list(vars.keys()):
-        return term.worth(vars[term.left])
+    if term.left in vars:
+        return as_value(vars[term.left])
     else:
         return term.str
 
 ########################### binary operation evals: add, mul, pwr #######################
-def eval_add(term, vars):
-    #calc left and right summands
-    #to check if string is returned
-    left = calc_eval(term.left,vars) 
-    right = calc_eval(term.right,vars)
+def eval_add(term, vars, memo):
+    #left and right summands are already evaluated
+    #check if string is returned
+    left = memo[id(term.left)] 
+    right = memo[id(term.right)]
 
     if isinstance(left,str) and isinstance(right,str):
         return f'{term.left.str} + {term.right.str}'
@@ -51,10 +72,10 @@ def eval_add(term, vars):
     else:
         return left + right
 
-def eval_mul(term, vars):
+def eval_mul(term, vars, memo):
     #same idea as eval_add
-    left = calc_eval(term.left,vars)
-    right = calc_eval(term.right,vars)
+    left = memo[id(term.left)]
+    right = memo[id(term.right)]
 
     if isinstance(left,str) and isinstance(right,str):
         return f'({term.left.str}) * ({term.right.str})'
@@ -65,9 +86,9 @@ def eval_mul(term, vars):
     else:
         return left * right
 
-def eval_pwr(term, vars):
-    base = calc_eval(term.left,vars)
-    exponent = calc_eval(term.right,vars)
+def eval_pwr(term, vars, memo):
+    base = memo[id(term.left)]
+    exponent = memo[id(term.right)]
     if isinstance(base,str) and isinstance(exponent,str):
         return f'{term.left.str}**{term.right.str}'
     elif isinstance(base,str) and not isinstance(exponent,str):
@@ -75,39 +96,40 @@ def eval_pwr(term, vars):
     elif not isinstance(base,str) and isinstance(exponent,str):
         return f'{base}**{term.right.str}'
     else:
-        return base**exponent
+        #np.power as in plan_eval, so 0^(-1) is inf and not an error
+        return np.power(base, exponent)
 
 ########################## special function evals: exp, trig fcts, log #######################
-def eval_exp(term, vars):
-    arg = calc_eval(term.left,vars)
+def eval_exp(term, vars, memo):
+    arg = memo[id(term.left)]
     if isinstance(arg,str):
         return f'exp({arg})'
     else:
         return np.exp(arg)
     
-def eval_sin(term, vars):
-    arg = calc_eval(term.left,vars)
+def eval_sin(term, vars, memo):
+    arg = memo[id(term.left)]
     if isinstance(arg,str):
         return f'sin({arg})'
     else:
         return np.sin(arg)
 
-def eval_cos(term, vars):
-    arg = calc_eval(term.left,vars)
+def eval_cos(term, vars, memo):
+    arg = memo[id(term.left)]
     if isinstance(arg,str):
         return f'cos({arg})'
     else:
         return np.cos(arg)
     
-def eval_tan(term, vars):
-    arg = calc_eval(term.left,vars)
+def eval_tan(term, vars, memo):
+    arg = memo[id(term.left)]
     if isinstance(arg,str):
         return f'tan({arg})'
     else:
         return np.tan(arg)
 
-def eval_log(term, vars):
-    arg = calc_eval(term.left,vars)
+def eval_log(term, vars, memo):
+    arg = memo[id(term.left)]
     if isinstance(arg,str):
         return f'log({arg})'
     else:
@@ -118,4 +140,119 @@ cases = {
         'const': eval_const, 'id': eval_id, 'add': eval_add, 'mul': eval_mul,
         'pwr': eval_pwr, 'exp': eval_exp, 'sin': eval_sin, 'cos': eval_cos,
         'tan': eval_tan, 'log': eval_log
-        }
\ No newline at end of file
+        }
+#the same by opcode
+code_cases = [cases[tag] for tag in tags]
+
+########################## partial evaluation #############################################
+def calc_partial_eval(term: myexpr, vars: dict) -> myexpr:
+    '''
+    Substitutes the values in vars = {'variable': value} into the term.
+    Returns a myexpr, in which every subterm that does not contain
+    a remaining variable is folded into a constant, e.g.
+    calc_partial_eval(x*(y + 1), {'y': 2}) -> x*(3.0)
+    If all variables are given the result is a single constant.
+    '''
+    done = {}
+    for node in postorder(term):
+        if node.op == 'const':
+            res = node
+        elif node.op == 'id':
+            res = myexpr('const', f'{float(vars[node.left])}') if node.left in vars else node
+        else:
+            left = done[id(node.left)]
+            right = done[id(node.right)] if node.right is not None else None
+            res = None
+            if left.op == 'const' and (right is None or right.op == 'const'):
+                with np.errstate(all='ignore'):
+                    val = numeric[node.op](float(left.left), float(right.left) if right is not None else None)
+                if np.isfinite(val):
+                    res = myexpr('const', f'{float(val)}')
+            if res is None:
+                res = myexpr(node.op, left, right)
+        done[id(node)] = res
+    return done[id(term)]
+
+
+########################## batch evaluation over arrays of points #############################
+def calc_eval_array(term: myexpr, vars: dict):
+    '''
+    Batch version of calc_eval.
+    The vars dictionary should be of the form {'variable': array},
+    the arrays are broadcast against each other (so a meshgrid or
+    a single scalar work as well). Every node of the term is evaluated
+    once over the whole array using the dict array_cases.
+    All variables of the term have to be provided.
+    Returns an ndarray of the broadcast shape of the inputs.
+    '''
+    arrays, shape = as_arrays(vars)
+    res = np.asarray(array_eval(term, arrays, {}))
+    if res.shape != shape:
+        #constant (sub)terms come back as scalars
+        res = np.broadcast_to(res, shape).copy()
+    return res
+
+def as_arrays(vars: dict):
+    '''
+    Converts the values in vars to float ndarrays (without copying float input)
+    and returns them along with their common broadcast shape.
+    '''
+    arrays = {}
+    for key, val in vars.items():
+        arr = np.asarray(val)
+        if arr.dtype.kind not in 'fc':
+            #ints would break negative exponents
+            arr = arr.astype(float)
+        arrays[key] = arr
+    shape = np.broadcast_shapes(*[arr.shape for arr in arrays.values()])
+    return arrays, shape
+
+def array_eval(term: myexpr, vars: dict, memo: dict):
+    '''
+    Evaluation step of calc_eval_array, in post order like calc_eval.
+    memo maps id(node) -> array, so subterms that are shared
+    between several parents are only evaluated once per call.
+    '''
+    for node in postorder(term):
+        if id(node) not in memo:
+            memo[id(node)] = array_cases[node.op](node, vars, memo)
+    return memo[id(term)]
+
+def arr_eval_const(term, vars, memo):
+    return float(term.left)
+
+def arr_eval_id(term, vars, memo):
+    if term.left not in vars:
+        raise Exception(f'No values provided for variable "{term.left}".')
+    return vars[term.left]
+
+def arr_eval_add(term, vars, memo):
+    return memo[id(term.left)] + memo[id(term.right)]
+
+def arr_eval_mul(term, vars, memo):
+    return memo[id(term.left)] * memo[id(term.right)]
+
+def arr_eval_pwr(term, vars, memo):
+    return np.power(memo[id(term.left)], memo[id(term.right)])
+
+def arr_eval_exp(term, vars, memo):
+    return np.exp(memo[id(term.left)])
+
+def arr_eval_sin(term, vars, memo):
+    return np.sin(memo[id(term.left)])
+
+def arr_eval_cos(term, vars, memo):
+    return np.cos(memo[id(term.left)])
+
+def arr_eval_tan(term, vars, memo):
+    return np.tan(memo[id(term.left)])
+
+def arr_eval_log(term, vars, memo):
+    return np.log(memo[id(term.left)])
+
+
+array_cases = {
+        'const': arr_eval_const, 'id': arr_eval_id, 'add': arr_eval_add, 'mul': arr_eval_mul,
+        'pwr': arr_eval_pwr, 'exp': arr_eval_exp, 'sin': arr_eval_sin, 'cos': arr_eval_cos,
+        'tan': arr_eval_tan, 'log': arr_eval_log
+        }
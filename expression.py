@@ -1,9 +1,40 @@
 '''
 Contains the basics class for expression.
 '''
+__version__ = '1.1.0'
+
 import numpy as np
+import weakref
+import operator
+from enum import IntEnum
 tags = ['id', 'const', 'add', 'mul', 'pwr', 'exp', 'sin', 'cos', 'tan', 'log']
 
+class opcode(IntEnum):
+    '''
+    Integer codes of the tags, opcode.ADD == tags.index('add') etc.
+    Used as index into dispatch tables.
+    '''
+    ID = 0
+    CONST = 1
+    ADD = 2
+    MUL = 3
+    PWR = 4
+    EXP = 5
+    SIN = 6
+    COS = 7
+    TAN = 8
+    LOG = 9
+
+#tag (or opcode) -> opcode
+codes = {tag: opcode(i) for i, tag in enumerate(tags)}
+codes.update({code: code for code in opcode})
+#the leaf codes, plain names since enum attribute lookups are slow
+ID, CONST = opcode.ID, opcode.CONST
+
+#table for hash consing: structural key -> the one node with that structure
+#weak, so nodes that are no longer used anywhere are dropped from it
+interned = weakref.WeakValueDictionary()
+
 class myexpr:
     '''
     the overarching expression class, consists of two objects and an operation
@@ -16,58 +47,319 @@ class myexpr:
     4. constants -> myexpr('const', 'value')
     5. e^x -> myexpr('exp', myexpr('id'))
 
-    Upon initializing it creates
-    (i) self.worth = lambda x: output -> function that is used for evaluation, x is value at which eval is called, output is dependent on self.op
-    (ii) self.str -> string representation for __str__ and __repr__
+    Every node has
+    (i) self.worth(x) -> method that is used for evaluation, x is value at which eval is called, output is dependent on self.op
+        (every variable takes the value x, for compound terms this is calc_worth, which works without recursion)
+    (ii) self.str -> string representation for __str__ and __repr__, rendered lazily on first use
+    (iii) self.code -> the opcode of self.op, see opcode above
+    (iv) self.deps -> the set of variables the term depends on, filled in by calc_vars
+    (v) self.order, self.plan -> the nodes of the term in post order and the steps of plan_eval,
+        built on first use (see term_order and eval_plan), since the nodes never change
+
+    The attributes are __slots__, so nodes have no __dict__.
+    Terms can be pickled (and copied), see __reduce__.
 
     To create multiple different variables use explicit variable naming: myexpr('id','VARIABLE NAME').
+
+    Nodes are hash consed: creating a node with the same op and the same children
+    (or the same string for id and const) as an existing node returns the existing node.
+    So equal structure means equal identity and a term is a DAG, in which identical
+    subterms are stored (and can be evaluated) only once.
+    Therefore nodes must not be modified after creation.
     '''
-    def __init__(self, op, left=None, right=None):
-        self.left = left
-        self.right = right
-        self.op = op
-        if self.op not in tags:
-            raise Exception(f'Unknown expression type "{self.op}".')
-        if self.op == 'id':
-            if self.left == None:
-                #only one variable, or unnamed
-                #default string
-                self.left = 'x'
-                self.str = 'x'
-            else:
-                self.str = self.left
-            self.worth = lambda x: float(x) #echoes the value at which it is evaluated
-        if self.op == 'const':
-            self.worth = lambda x: float(self.left)
-            self.str = self.left
-        if self.op == 'sin':
-            self.worth = lambda x: np.sin(self.left.worth(x))
-            self.str = 'sin(' + f'{self.left.str}' + ')'
-        if self.op == 'cos':
-            self.worth = lambda x: np.cos(self.left.worth(x))
-            self.str = 'cos(' + f'{self.left.str}' + ')'
-        if self.op == 'tan':
-            self.worth = lambda x: np.tan(self.left.worth(x))
-            self.str = 'tan(' + f'{self.left.str}' + ')'
-        if self.op == 'add':
-            self.worth = lambda x: self.left.worth(x) + self.right.worth(x)
-            self.str = f'{self.left.str} + {self.right.str}'
-        if self.op == 'mul':
-            self.worth = lambda x: self.left.worth(x)*self.right.worth(x)
-            self.str = f'({self.left.str})' + '*' + f'({self.right.str})'
-        if self.op == 'pwr':
-            self.worth = lambda x: self.left.worth(x)**self.right.worth(x)
-            self.str = f'({self.left})' + '^' + f'({self.right})'
-        if self.op == 'exp':
-            self.worth = lambda x: np.exp(self.left.worth(x))
-            self.str = 'exp(' + f'{self.left.str}' + ')'
-        if self.op == 'log':
-            self.worth = lambda x: np.log(self.left.worth(x))
-            self.str = 'log(' + f'{self.left.str}' + ')'
-    
+    __slots__ = ('op', 'code', 'left', 'right', 'key', '_str', 'compiled', 'deps', 'order', 'plan', '__weakref__')
+
+    def __new__(cls, op, left=None, right=None):
+        '''
+        Looks the node up in the hash consing table and only creates it if it is new.
+        op can be the tag or its opcode.
+        '''
+        code = codes.get(op)
+        if code is None:
+            raise Exception(f'Unknown expression type "{op}".')
+        if code is ID and left is None:
+            #only one variable, or unnamed
+            left = 'x'
+        #strings (names, values of constants) by value, children by identity,
+        #which is enough since they are hash consed themselves
+        key = (code,
+               left if isinstance(left, str) or left is None else id(left),
+               right if isinstance(right, str) or right is None else id(right))
+        node = interned.get(key)
+        if node is not None:
+            return node
+        node = object.__new__(cls)
+        node.op = tags[code]
+        node.code = code
+        node.left = left
+        node.right = right
+        node.key = key
+        node.compiled = None
+        node.deps = None
+        node.order = None
+        node.plan = None
+        #only leaves know their string from the start
+        node._str = left if code is ID else f'{left}' if code is CONST else None
+        interned[key] = node
+        return node
+
+    def worth(self, x):
+        '''
+        Value of the term with every variable set to x,
+        dispatched on the opcode with worth_table.
+        '''
+        return worth_table[self.code](self, x)
+
+    @property
+    def str(self):
+        '''
+        String representation, rendered on first use by render() and then kept.
+        Building a term therefore costs nothing for its string.
+        '''
+        if self._str is None:
+            self._str = render(self)
+        return self._str
+
+    def __reduce__(self):
+        '''
+        Pickles the term as its flat list of nodes (see to_nodes),
+        so deep terms don't hit the recursion limit of pickle.
+        Unpickling goes through myexpr again, i.e. the nodes are hash consed
+        in the receiving process. The compiled functions are not pickled.
+        '''
+        return (from_nodes, (to_nodes(self),))
+
     def __str__(self):
         return self.str
     
     def __repr__(self):
         return self.str
 
+
+#string templates (before, between, after) for the arguments of each tag
+templates = {
+        'add': ('', ' + ', ''), 'mul': ('(', ')*(', ')'), 'pwr': ('(', ')^(', ')'),
+        'exp': ('exp(', None, ')'), 'sin': ('sin(', None, ')'), 'cos': ('cos(', None, ')'),
+        'tan': ('tan(', None, ')'), 'log': ('log(', None, ')')
+        }
+
+def render(term: myexpr) -> str:
+    '''
+    Renders the string of a term, e.g. (x)*(sin(y)) + 1.
+    Uses a stack of pending nodes and pieces of text instead of recursion
+    and joins all pieces once at the end, so the cost is linear in the length
+    of the string. Subterms whose string is already known are not rendered again.
+    '''
+    pieces = []
+    stack = [term]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            pieces.append(item)
+        elif item._str is not None:
+            pieces.append(item._str)
+        else:
+            before, between, after = templates[item.op]
+            #pushed in reverse order
+            stack.append(after)
+            if between is not None:
+                stack.append(item.right)
+                stack.append(between)
+            stack.append(item.left)
+            stack.append(before)
+    return ''.join(pieces)
+
+def as_value(x):
+    '''
+    Value of a variable: ndarrays (including np.memmap) are passed on as they are,
+    without copying, so the numpy functions work on them directly,
+    everything else is converted to float.
+    '''
+    return x if isinstance(x, np.ndarray) else float(x)
+
+#numerical operation by opcode for plan_eval, None for the leaves
+plan_fcts = [None, None, operator.add, operator.mul, np.power, np.exp, np.sin, np.cos, np.tan, np.log]
+
+#numerical operation for each tag, receives the values of left and right
+numeric = {
+        'add': lambda l, r: l + r, 'mul': lambda l, r: l*r, 'pwr': lambda l, r: np.power(l, r),
+        'exp': lambda l, r: np.exp(l), 'sin': lambda l, r: np.sin(l), 'cos': lambda l, r: np.cos(l),
+        'tan': lambda l, r: np.tan(l), 'log': lambda l, r: np.log(l)
+        }
+
+def calc_worth(term: myexpr, x):
+    '''
+    Evaluates a term with every variable set to x, this is the worth of compound terms.
+    Goes through the steps of eval_plan instead of calling the worth of the children,
+    so deep terms don't hit the recursion limit.
+    '''
+    x = as_value(x)
+    res = []
+    append = res.append
+    for fct, left, right in term.plan or eval_plan(term):
+        if fct is None:
+            append(x if left is None else left)
+        elif right is None:
+            append(fct(res[left]))
+        else:
+            append(fct(res[left], res[right]))
+    return res[-1]
+
+#worth of a node by opcode
+worth_table = [lambda term, x: as_value(x), lambda term, x: float(term.left)] + [calc_worth]*(len(tags) - 2)
+
+def plan_eval(term: myexpr, values: dict):
+    '''
+    Value of a term, values = {'variable': value} has to contain all its variables.
+    One pass over the steps of eval_plan, as in calc_worth.
+    '''
+    res = []
+    append = res.append
+    for fct, left, right in term.plan or eval_plan(term):
+        if fct is None:
+            append(values[right] if left is None else left)
+        elif right is None:
+            append(fct(res[left]))
+        else:
+            append(fct(res[left], res[right]))
+    return res[-1]
+
+def eval_plan(term: myexpr) -> list:
+    '''
+    Steps of plan_eval, one (function, left, right) per node in post order, where
+    left and right are the positions of the values of the children (right None if unary).
+    Variables are (None, None, name), constants (None, value, None).
+    Built on first use and kept on the term.
+    '''
+    if term.plan is None:
+        order = term_order(term)
+        index = {id(node): i for i, node in enumerate(order)}
+        plan = []
+        for node in order:
+            if node.code is ID:
+                plan.append((None, None, node.left))
+            elif node.code is CONST:
+                plan.append((None, float(node.left), None))
+            else:
+                plan.append((plan_fcts[node.code], index[id(node.left)],
+                             None if node.right is None else index[id(node.right)]))
+        term.plan = plan
+    return term.plan
+
+def term_order(term: myexpr) -> list:
+    '''
+    postorder(term), computed on first use and kept on the term.
+    The list must not be modified.
+    '''
+    if term.order is None:
+        term.order = postorder(term)
+    return term.order
+
+def postorder(term: myexpr, seen: set = None) -> list:
+    '''
+    Lists the nodes of a term in post order, i.e. children before their parents,
+    with every node appearing exactly once, even if it is shared between parents.
+    Uses an explicit stack instead of recursion.
+    seen is a set of ids of nodes to leave out (along with their subterms), it is updated,
+    so several terms can be listed one after the other without repeating shared nodes.
+    '''
+    order = []
+    if seen is None:
+        seen = set()
+    stack = [(term, False)]
+    while stack:
+        node, visited = stack.pop()
+        if visited:
+            order.append(node)
+            continue
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        stack.append((node, True))
+        if node.op not in ('id', 'const'):
+            if node.right is not None:
+                stack.append((node.right, False))
+            stack.append((node.left, False))
+    return order
+
+def to_dag(terms: list):
+    '''
+    Flat list of the distinct nodes of several terms in post order, one tuple (code, left, right) per node,
+    and the list of the positions of the terms (the roots).
+    Nodes shared between the terms are listed once.
+    For id and const left is the string, for compound terms
+    left and right are the positions of the children in the list (right None if unary).
+    This is the one place that defines the layout, see to_nodes and serialization.py.
+    '''
+    seen = set()
+    order = []
+    for term in terms:
+        order += postorder(term, seen)
+    index = {id(node): i for i, node in enumerate(order)}
+    nodes = []
+    for node in order:
+        if node.op in ('id', 'const'):
+            nodes.append((int(node.code), node.left, None))
+        else:
+            nodes.append((int(node.code), index[id(node.left)],
+                          None if node.right is None else index[id(node.right)]))
+    return nodes, [index[id(term)] for term in terms]
+
+def from_dag(nodes: list, roots: list) -> list:
+    '''
+    Rebuilds the terms at the positions roots from the list of to_dag.
+    '''
+    built = []
+    for code, left, right in nodes:
+        if code == ID or code == CONST:
+            built.append(myexpr(code, left))
+        else:
+            built.append(myexpr(code, built[left], None if right is None else built[right]))
+    return [built[i] for i in roots]
+
+def to_nodes(term: myexpr) -> list:
+    '''
+    Flat list of the nodes of a term in post order, see to_dag, the last node is the root.
+    '''
+    return to_dag([term])[0]
+
+def from_nodes(nodes: list) -> myexpr:
+    '''
+    Rebuilds the term from the list of to_nodes, the last node is the root.
+    '''
+    return from_dag(nodes, [len(nodes) - 1])[0]
+
+no_vars = frozenset()
+
+def calc_vars(term: myexpr) -> frozenset:
+    '''
+    The set of names of the variables a term depends on, e.g. {'x', 'y'} for sin(x)*y + 2.
+    The sets are stored on the nodes (self.deps), so every node is analysed only once
+    and later calls return immediately. Subterms with the same variables share one set.
+    Uses an explicit stack instead of recursion.
+    '''
+    stack = [term]
+    while stack:
+        node = stack[-1]
+        if node.deps is not None:
+            stack.pop()
+            continue
+        if node.code is ID:
+            node.deps = frozenset([node.left])
+        elif node.code is CONST:
+            node.deps = no_vars
+        else:
+            todo = [child for child in (node.left, node.right) if child is not None and child.deps is None]
+            if todo:
+                stack.extend(todo)
+                continue
+            left = node.left.deps
+            right = no_vars if node.right is None else node.right.deps
+            if right <= left:
+                node.deps = left
+            elif left <= right:
+                node.deps = right
+            else:
+                node.deps = left | right
+        stack.pop()
+    return term.deps
@@ -0,0 +1,224 @@
+'''
+Forward mode automatic differentiation with dual numbers.
+Every node is evaluated to a pair (value, tangent), where the tangent is the
+directional derivative of the node in the seeded direction.
+The pairs are propagated in one traversal through the same tags as in
+evaluation.py, using the dict cases defined at the end of the document,
+so no symbolic derivative is ever built.
+
+A tangent of None stands for zero (e.g. constants or unseeded variables),
+which saves the multiplications with zero and the local derivatives.
+Tangents may have an extra leading axis for several directions at once,
+i.e. value shape S and tangent shape (k,) + S, which gives k columns
+of a Jacobian in one traversal.
+'''
+import numpy as np
+from expression import *
+from evaluation import as_arrays
+
+
+def calc_jvp(term: myexpr, vals: dict, tangents: dict):
+    '''
+    Jacobian-vector product (directional derivative) of term.
+    vals is a dict {'variable': value} as for calc_eval_array,
+    tangents is a dict {'variable': seed}, where the seeds make up the direction.
+    Variables missing in tangents have seed 0.
+    Returns (value, tangent).
+    '''
+    arrays, shape = as_arrays(vals)
+    memo = forward_sweep([term], arrays, tangents)
+    value, tangent = memo[id(term)]
+    return np.broadcast_to(value, shape).copy(), dense(tangent, shape, tangents)
+
+def calc_jacobian(terms: list, vars: list, vals: dict):
+    '''
+    Jacobian of a list of terms (e.g. the components of a vect) w.r.t. vars.
+    Seeds all len(vars) directions at once, so it needs only one traversal
+    of the terms, shared subterms between components are evaluated once.
+    Returns an ndarray of shape (len(terms), len(vars)) + shape of the points.
+    '''
+    arrays, shape = as_arrays(vals)
+    n = len(vars)
+    seeds = {}
+    for i, v in enumerate(vars):
+        seed = np.zeros((n,) + (1,)*len(shape))
+        seed[i] = 1.0
+        seeds[v] = seed
+    memo = forward_sweep(terms, arrays, seeds)
+    jac = np.empty((len(terms), n) + shape)
+    for i, term in enumerate(terms):
+        jac[i] = dense(memo[id(term)][1], shape, seeds)
+    return jac
+
+def forward_sweep(terms: list, vars: dict, tangents: dict) -> dict:
+    '''
+    Evaluates (value, tangent) for all nodes of the given terms,
+    children before parents. Returns the memo dict id(node) -> (value, tangent).
+    '''
+    memo = {}
+    for term in terms:
+        for node in postorder(term):
+            if id(node) not in memo:
+                memo[id(node)] = cases[node.op](node, vars, tangents, memo)
+    return memo
+
+def dense(tangent, shape: tuple, tangents: dict):
+    '''
+    Turns a tangent into a full ndarray, in particular None into zeros
+    of the shape given by the points and the seeds.
+    '''
+    full = np.broadcast_shapes(shape, *[np.shape(t) for t in tangents.values()])
+    if tangent is None:
+        return np.zeros(full)
+    return np.broadcast_to(tangent, full).copy()
+
+########################### helpers for tangents that might be None ####################
+def plus(t1, t2):
+    if t1 is None:
+        return t2
+    if t2 is None:
+        return t1
+    return t1 + t2
+
+def times(t, factor):
+    if t is None:
+        return None
+    return t*factor
+
+########################### dual numbers as values #####################################
+class dual:
+    '''
+    Dual number val + tan*eps with eps^2 = 0, i.e. a value with its tangent
+    (tan None stands for zero, as above).
+    Supports + - * / ** and the numpy functions exp, sin, cos, tan, log
+    (through __array_ufunc__, so also mixed with floats and ndarrays),
+    so code written for numbers runs unchanged on duals and carries the tangents along,
+    e.g. the backward sweep of reverse.py for hvp.
+    '''
+    def __init__(self, val, tan=None):
+        self.val = val
+        self.tan = tan
+
+    def __repr__(self):
+        return f'dual({self.val}, {self.tan})'
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method != '__call__' or kwargs or ufunc not in dual_rules:
+            return NotImplemented
+        return dual_rules[ufunc](*[x if isinstance(x, dual) else dual(x) for x in inputs])
+
+    def __add__(self, other):
+        return np.add(self, other)
+
+    def __radd__(self, other):
+        return np.add(other, self)
+
+    def __sub__(self, other):
+        return np.subtract(self, other)
+
+    def __rsub__(self, other):
+        return np.subtract(other, self)
+
+    def __mul__(self, other):
+        return np.multiply(self, other)
+
+    def __rmul__(self, other):
+        return np.multiply(other, self)
+
+    def __truediv__(self, other):
+        return np.true_divide(self, other)
+
+    def __rtruediv__(self, other):
+        return np.true_divide(other, self)
+
+    def __pow__(self, other):
+        return np.power(self, other)
+
+    def __rpow__(self, other):
+        return np.power(other, self)
+
+    def __neg__(self):
+        return np.negative(self)
+
+def dual_pwr(a, b):
+    val = a.val**b.val
+    tangent = None
+    if a.tan is not None:
+        tangent = a.tan*(b.val*a.val**(b.val - 1))
+    if b.tan is not None:
+        tangent = plus(tangent, b.tan*(val*np.log(a.val)))
+    return dual(val, tangent)
+
+#rules for the numpy functions on duals, the arguments are duals
+dual_rules = {
+        np.add: lambda a, b: dual(a.val + b.val, plus(a.tan, b.tan)),
+        np.subtract: lambda a, b: dual(a.val - b.val, plus(a.tan, times(b.tan, -1.0))),
+        np.multiply: lambda a, b: dual(a.val*b.val, plus(times(a.tan, b.val), times(b.tan, a.val))),
+        np.true_divide: lambda a, b: dual(a.val/b.val, plus(times(a.tan, 1/b.val), times(b.tan, -a.val/b.val**2))),
+        np.power: dual_pwr,
+        np.negative: lambda a: dual(-a.val, times(a.tan, -1.0)),
+        np.exp: lambda a: dual(np.exp(a.val), times(a.tan, np.exp(a.val))),
+        np.sin: lambda a: dual(np.sin(a.val), times(a.tan, np.cos(a.val))),
+        np.cos: lambda a: dual(np.cos(a.val), times(a.tan, -np.sin(a.val))),
+        np.tan: lambda a: dual(np.tan(a.val), times(a.tan, 1/np.cos(a.val)**2)),
+        np.log: lambda a: dual(np.log(a.val), times(a.tan, 1/a.val))
+        }
+
+########################### dual number rules ##########################################
+def fwd_const(term, vars, tangents, memo):
+    return float(term.left), None
+
+def fwd_id(term, vars, tangents, memo):
+    if term.left not in vars:
+        raise Exception(f'No values provided for variable "{term.left}".')
+    return vars[term.left], tangents.get(term.left)
+
+def fwd_add(term, vars, tangents, memo):
+    l, tl = memo[id(term.left)]
+    r, tr = memo[id(term.right)]
+    return l + r, plus(tl, tr)
+
+def fwd_mul(term, vars, tangents, memo):
+    l, tl = memo[id(term.left)]
+    r, tr = memo[id(term.right)]
+    return l*r, plus(times(tl, r), times(tr, l))
+
+def fwd_pwr(term, vars, tangents, memo):
+    l, tl = memo[id(term.left)]
+    r, tr = memo[id(term.right)]
+    val = l**r
+    #d(l^r) = r*l^(r-1) dl + l^r*log(l) dr, the log only if the exponent varies
+    tangent = None
+    if tl is not None:
+        tangent = tl*(r*l**(r - 1))
+    if tr is not None:
+        tangent = plus(tangent, tr*(val*np.log(l)))
+    return val, tangent
+
+def fwd_exp(term, vars, tangents, memo):
+    l, tl = memo[id(term.left)]
+    val = np.exp(l)
+    return val, times(tl, val)
+
+def fwd_sin(term, vars, tangents, memo):
+    l, tl = memo[id(term.left)]
+    return np.sin(l), None if tl is None else tl*np.cos(l)
+
+def fwd_cos(term, vars, tangents, memo):
+    l, tl = memo[id(term.left)]
+    return np.cos(l), None if tl is None else -tl*np.sin(l)
+
+def fwd_tan(term, vars, tangents, memo):
+    l, tl = memo[id(term.left)]
+    return np.tan(l), None if tl is None else tl/np.cos(l)**2
+
+def fwd_log(term, vars, tangents, memo):
+    l, tl = memo[id(term.left)]
+    return np.log(l), None if tl is None else tl/l
+
+
+cases = {
+        'const': fwd_const, 'id': fwd_id, 'add': fwd_add, 'mul': fwd_mul,
+        'pwr': fwd_pwr, 'exp': fwd_exp, 'sin': fwd_sin, 'cos': fwd_cos,
+        'tan': fwd_tan, 'log': fwd_log
+        }
@@ -1,47 +1,274 @@
+'''
+Plotting of myexpr terms and vector fields with matplotlib.
+By default every function shows its figure with plt.show().
+With filename='plot.png' (or .svg, .pdf, ...) the figure is written to the file instead,
+without pyplot: the figures for files are plain matplotlib figures on the Agg canvas,
+taken from figure_pool and reused for the next plot, so nothing blocks and no
+figures pile up. render_batch renders many plots into files in parallel processes.
+'''
+import os
+from concurrent.futures import ProcessPoolExecutor
 from expression import *
 import numpy as np
 from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from derivatives import *
 from evaluation import *
 from vectors import *
 
-def myplot(term: myexpr, domain: list, var: str, format = 'b-', **kwargs):
+#projection -> (figure, axes) that are reused for plots into files
+figure_pool = {}
+
+def get_axes(filename: str = None, projection: str = None):
+    '''
+    Axes to draw on. Without filename the current pyplot axes
+    (a new pyplot figure for 3D), otherwise the cleared axes of the
+    figure in figure_pool for the projection.
+    '''
+    if filename is None:
+        if projection is None:
+            return plt.gca()
+        return plt.figure().add_subplot(projection=projection)
+    if projection not in figure_pool:
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        figure_pool[projection] = (fig, fig.add_subplot(projection=projection))
+    fig, ax = figure_pool[projection]
+    ax.clear()
+    return ax
+
+def finish(ax, filename: str = None):
+    '''
+    Shows the figure with plt.show() or writes it to filename,
+    the format is given by the extension.
+    '''
+    if filename is None:
+        plt.show()
+    else:
+        ax.figure.savefig(filename)
+
+def render_batch(jobs: list, workers: int = None) -> list:
+    '''
+    Renders many plots into files, e.g.
+    render_batch([(myplot, (term, domain, 'x'), {'filename': 'term.png'}), ...])
+    Each job is (plot function, args, kwargs) and kwargs has to contain the filename.
+    The jobs are distributed over workers processes (default os.cpu_count()),
+    each of which draws on its own figure_pool, the terms are pickled (see myexpr.__reduce__).
+    With workers = 1 the jobs are rendered in this process.
+    Returns the list of filenames.
+    '''
+    for _, _, kwargs in jobs:
+        if kwargs.get('filename') is None:
+            raise Exception('Every job of render_batch needs a filename.')
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(jobs) <= 1:
+        return [render_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(render_job, jobs, chunksize=max(1, len(jobs)//(4*workers))))
+
+def render_job(job: tuple) -> str:
+    '''
+    Runs one job of render_batch, returns its filename.
+    '''
+    fct, args, kwargs = job
+    fct(*args, **kwargs)
+    return kwargs['filename']
+
+def myplot(term: myexpr, domain: list, var: str, format = 'b-', adaptive: bool = False,
+           tol: float = 1e-3, max_evals: int = 2000, derivative: bool = False,
+           filename: str = None, **kwargs):
     '''
     Wrapper for plt.plot
+    With filename the figure is written to the file instead of shown.
+    With adaptive=True only the interval [min(domain), max(domain)] is used
+    and the points are chosen by adaptive_sample with tol, max_evals and derivative.
     '''
-    vals = []
-    for i in domain:
-        vals.append(calc_eval(term,{var: i}))
+    if adaptive:
+        domain, vals = adaptive_sample(term, var, domain, tol, max_evals, derivative)
+    else:
+        #evaluate on the whole domain at once
+        vals = calc_eval_array(term,{var: domain})
     
-    plt.plot(domain,vals,format, label = term.str, **kwargs)
-    plt.xlabel(var)
-    plt.legend()
-    plt.show()
+    ax = get_axes(filename)
+    ax.plot(domain,vals,format, label = term.str, **kwargs)
+    ax.set_xlabel(var)
+    ax.legend()
+    finish(ax, filename)
     
     return 0
 
-def myscatter(term: myexpr, domain: list, var: str, marker = 'o', alpha = 1, **kwargs):
+#number of splits in a row in which the values have to grow towards a sign change
+#to break the curve there (see adaptive_sample), under-sampled oscillations do this less often
+pole_splits = 4
+
+def adaptive_sample(term: myexpr, var: str, interval: list, tol: float = 1e-3,
+                    max_evals: int = 2000, derivative: bool = False, initial: int = 17):
+    '''
+    Samples a term on interval = [a, b] for plotting, with more points where the curve bends.
+    Starts with initial equidistant points and splits every interval in which
+    the straight line between its end points is off by more than tol times
+    the range of the values (see value_scale), in rounds, each round being
+    one evaluation of all new midpoints with calc_eval_array.
+    The error of an interval is the distance of the value at the midpoint from the line,
+    with derivative=True it is estimated from the derivative (calc_diff) at the end points
+    instead, so only midpoints of intervals that are split are evaluated.
+    At most max_evals evaluations (of the term and its derivative) are made,
+    initial is reduced to fit, but there are always at least the two end points.
+    If there are too many candidates the intervals with the largest errors are split first.
+    A term that doesn't depend on var is a straight line and only evaluated at the end points.
+    An interval is only accepted after the midpoints of it and of its parent were checked.
+    Intervals with a pole, in which the values change sign and jump by more than
+    the range of the values (e.g. at the poles of tan) are broken with a NaN,
+    so that plt.plot doesn't draw a line across the singularity, see the end of the function.
+    Returns the arrays (points, values).
+    '''
+    a, b = float(min(interval)), float(max(interval))
+    if var not in calc_vars(term):
+        xs = np.array([a, b])
+        with np.errstate(all='ignore'):
+            return xs, calc_eval_array(term, {var: xs})
+    fcts = [term]
+    if derivative:
+        fcts.append(calc_diff(term, var, simplify=True))
+    def evaluate(points):
+        with np.errstate(all='ignore'):
+            return [calc_eval_array(fct, {var: points}) for fct in fcts]
+
+    initial = max(2, min(initial, max_evals//len(fcts)))
+    xs = np.linspace(a, b, initial)
+    ys, *ds = evaluate(xs)
+    evals = len(fcts)*initial
+    #error estimate of each interval, unknown at the start
+    err = np.full(initial - 1, np.inf)
+    #intervals whose error is small, but only known from the midpoint of their parent
+    pending = np.zeros(initial - 1, dtype=bool)
+    #number of splits in a row, in which the values grew towards a sign change (see below)
+    grows = np.zeros(initial - 1, dtype=int)
+    minwidth = (b - a)*1e-10
+    while True:
+        scale = value_scale(ys)
+        if derivative:
+            err = hermite_error(xs, ys, ds[0])
+        todo = ((err > tol*scale) | pending) & (np.diff(xs) > minwidth)
+        idx = np.nonzero(todo)[0]
+        budget = (max_evals - evals)//len(fcts)
+        if len(idx) == 0 or budget <= 0:
+            break
+        if len(idx) > budget:
+            idx = np.sort(idx[np.argsort(err[idx])[::-1][:budget]])
+        mids = (xs[idx] + xs[idx + 1])/2
+        ym, *dm = evaluate(mids)
+        evals += len(fcts)*len(idx)
+        #both halves of a split interval get the error at its midpoint,
+        #they are accepted once the midpoints of the interval and of its parent are on the line,
+        #so a coarse grid that happens to hit a periodic curve at the same phase isn't taken as a line
+        halves = midpoint_error(ys[idx], ym, ys[idx + 1])
+        small = halves <= tol*scale
+        accepted = small & pending[idx]
+        halves[accepted] = 0.0
+        #with derivative=True every interval is checked by hermite_error anyway
+        check = small & ~accepted & (not derivative)
+        err = np.insert(err, idx + 1, halves)
+        err[idx + np.arange(len(idx))] = halves
+        pending = np.insert(pending, idx + 1, check)
+        pending[idx + np.arange(len(idx))] = check
+        #the half with the sign change grows towards it, if the midpoint is larger
+        #than the end point of the same sign, as close to a pole
+        left, right = ys[idx], ys[idx + 1]
+        with np.errstate(all='ignore'):
+            larger = np.abs(ym) > np.where(ym*left > 0, np.abs(left), np.abs(right))
+            grows_left = larger & (left*ym < 0)
+            grows_right = larger & (ym*right < 0)
+        count = grows[idx] + 1
+        grows = np.insert(grows, idx + 1, np.where(grows_right, count, 0))
+        grows[idx + np.arange(len(idx))] = np.where(grows_left, count, 0)
+        xs = np.insert(xs, idx + 1, mids)
+        ys = np.insert(ys, idx + 1, ym)
+        if derivative:
+            ds = [np.insert(ds[0], idx + 1, dm[0])]
+
+    #break the curve at jumps across zero, i.e. poles of odd order, where there is evidence
+    #of a pole: the values grew towards the sign change in the last pole_splits splits,
+    #the interval was split down to minwidth without getting any closer to a line,
+    #or the derivatives at both ends have the same sign, opposite to the jump.
+    #Intervals that are left coarse because the budget ran out are not broken.
+    ys = np.where(np.isfinite(ys), ys, np.nan)
+    with np.errstate(all='ignore'):
+        pole = (grows >= pole_splits) | (np.diff(xs) <= minwidth)
+        if derivative:
+            slopes = ds[0]
+            pole |= (slopes[:-1]*slopes[1:] > 0) & (slopes[:-1]*np.diff(ys) < 0)
+        jumps = np.nonzero(pole & (err > tol*scale) & (np.abs(np.diff(ys)) > scale) & (ys[:-1]*ys[1:] < 0))[0]
+    xs = np.insert(xs, jumps + 1, (xs[jumps] + xs[jumps + 1])/2)
+    ys = np.insert(ys, jumps + 1, np.nan)
+    return xs, ys
+
+def value_scale(ys: np.ndarray) -> float:
+    '''
+    Range of the values between the 5th and 95th percentile,
+    so that the huge values close to a pole don't set the scale.
+    '''
+    finite = ys[np.isfinite(ys)]
+    if len(finite) == 0:
+        return 1.0
+    low, high = np.percentile(finite, [5, 95])
+    return high - low if high > low else max(abs(high), 1.0)
+
+def midpoint_error(left, mid, right):
+    '''
+    Distance of the midpoint value from the line between the end points.
+    Intervals at the border of the domain of the term (some of the values
+    are not finite) get an infinite error so they are split further,
+    intervals outside of the domain get 0.
+    '''
+    with np.errstate(all='ignore'):
+        res = np.abs(mid - (left + right)/2)
+    finite = np.isfinite(left) & np.isfinite(mid) & np.isfinite(right)
+    outside = ~np.isfinite(left) & ~np.isfinite(mid) & ~np.isfinite(right)
+    return np.where(finite, res, np.where(outside, 0.0, np.inf))
+
+def hermite_error(xs, ys, ds):
+    '''
+    Estimated distance of the curve from the line between the end points of each interval,
+    from the values and derivatives at the end points: the change of the slope
+    and the difference of the mean slope from the slope of the line, times the width.
+    Intervals with values that are not finite are treated as in midpoint_error.
+    '''
+    h = np.diff(xs)
+    with np.errstate(all='ignore'):
+        secant = np.diff(ys)/h
+        res = h*np.maximum(np.abs(np.diff(ds))/8, np.abs(secant - (ds[:-1] + ds[1:])/2)/4)
+    finite = np.isfinite(ys) & np.isfinite(ds)
+    both = finite[:-1] & finite[1:]
+    neither = ~finite[:-1] & ~finite[1:]
+    return np.where(both, res, np.where(neither, 0.0, np.inf))
+
+def myscatter(term: myexpr, domain: list, var: str, marker = 'o', alpha = 1, filename: str = None, **kwargs):
     '''
     Wrapper for plt.scatter
+    With filename the figure is written to the file instead of shown.
     '''
-    vals = []
-    for i in domain:
-        vals.append(calc_eval(term,{var: i}))
+    #evaluate on the whole domain at once
+    vals = calc_eval_array(term,{var: domain})
     
-    plt.scatter(domain,vals, marker = marker, alpha = alpha, label = term.str, **kwargs)
-    plt.xlabel(var)
-    plt.legend()
-    plt.show()
+    ax = get_axes(filename)
+    ax.scatter(domain,vals, marker = marker, alpha = alpha, label = term.str, **kwargs)
+    ax.set_xlabel(var)
+    ax.legend()
+    finish(ax, filename)
 
     return 0
 
-def my3Dsurface(function: myexpr, domain: dict):
+def my3Dsurface(function: myexpr, domain: dict, filename: str = None):
     '''
     Wrapper for plt.plot_trisurf (triangulated surface).
     function is a function R^2 -> R
     domain is a dictionary of two variables as keys
     and two lists as their values, which are the corresponding domains.
     Only works with square domains.
+    With filename the figure is written to the file instead of shown.
     '''
     #extract the variables
     x = list(domain.keys())[0]
@@ -57,28 +284,26 @@ def my3Dsurface(function: myexpr, domain: dict):
     x_vals, y_vals = np.meshgrid(x_temp,y_temp)
     x_vals = x_vals.flatten()
     y_vals = y_vals.flatten()
-    
-    #create list of points at which function is to be evaluated
-    eval_values = [{x: x_vals[i], y: y_vals[i]} for i in range(len(x_vals))]
 
-    #evaluate the function on the given domains
-    z_vals = np.array([calc_eval(function, vals) for vals in eval_values])
+    #evaluate the function on all points at once
+    z_vals = calc_eval_array(function, {x: x_vals, y: y_vals})
 
-    #matplotlib.pyplot setup
-    ax = plt.figure().add_subplot(projection='3d')
+    #matplotlib setup
+    ax = get_axes(filename, '3d')
 
     ax.plot_trisurf(x_vals, y_vals, z_vals.flatten(), linewidth=0.2, antialiased=True)
     ax.set_xlabel(x)
     ax.set_ylabel(y)
     ax.set_zlabel(function.str)
    
-    plt.show()
+    finish(ax, filename)
     return 0
 
-def myvectfield2D(vect_field: vect, domain: dict, **kwargs):
+def myvectfield2D(vect_field: vect, domain: dict, filename: str = None, **kwargs):
     '''
     Wrapper for plt.quiver.
     Domain is a dict of the form {'variable': list of vlaues for its domain}.
+    With filename the figure is written to the file instead of shown.
     '''
     #extract the variables
     x = list(domain.keys())[0]
@@ -87,24 +312,18 @@ def myvectfield2D(vect_field: vect, domain: dict, **kwargs):
     #grid set-up for domain
     x_vals, y_vals = np.meshgrid(np.array(domain[x]),np.array(domain[y]))
         
-    #create list of points at which vector is to be evaluated
-    eval_values = [{x: x_vals[i][j], y: y_vals[i][j]} for i in range(len(domain[y])) for j in range(len(domain[x]))]
-    
-    #evaluate the vector on the given domains
-    z_vals = [vect_eval(vect_field, vals) for vals in eval_values]
-
-    #read out component values
-    u = np.array([np.array([z_vals[len(domain[y])*i + j].components[0].worth(0) for j in range(len(domain[y]))]) for i in range(len(domain[x]))])
-    v = np.array([np.array([z_vals[len(domain[y])*k + l].components[1].worth(0) for l in range(len(domain[y]))]) for k in range(len(domain[x]))])
+    #evaluate both components on the whole grid at once
+    u, v = vect_eval_array(vect_field, {x: x_vals, y: y_vals})[:2]
 
-    plt.quiver(x_vals,y_vals,u,v,**kwargs)
-    plt.xlabel(x)
-    plt.ylabel(y)
-    plt.show()
+    ax = get_axes(filename)
+    ax.quiver(x_vals,y_vals,u,v,**kwargs)
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    finish(ax, filename)
 
     return 0
 
-def myvectfield3D(v_field: vect, domain: dict, **kwargs):
+def myvectfield3D(v_field: vect, domain: dict, filename: str = None, **kwargs):
     '''
     3D analogue of myvectfield2D().
     '''
@@ -116,24 +335,16 @@ def myvectfield3D(v_field: vect, domain: dict, **kwargs):
     #grid set-up for the domain
     x_vals, y_vals, z_vals = np.meshgrid(np.array(domain[x]), np.array(domain[y]), np.array(domain[z]))
 
-    #create list of points at which the vector is to be evaluated
-    eval_values = [{x: x_vals[i][j][k], y: y_vals[i][j][k], z: z_vals[i][j][k]} for i in range(len(domain[y])) for j in range(len(domain[x])) for k in range(len(domain[z]))]
-
-    #evaluate vector
-    v_vals = [vect_eval(v_field, vals) for vals in eval_values]
-
-    #read out component values
-    u = np.array([np.array([np.array([v_vals[len(domain[x])*len(domain[z])*l + len(domain[z])*k + j].components[0].worth(0) for j in range(len(domain[z]))]) for k in range(len(domain[x]))]) for l in range(len(domain[y]))])
-    v = np.array([np.array([np.array([v_vals[len(domain[x])*len(domain[z])*l + len(domain[z])*k + j].components[1].worth(0) for j in range(len(domain[z]))]) for k in range(len(domain[x]))]) for l in range(len(domain[y]))])
-    w = np.array([np.array([np.array([v_vals[len(domain[x])*len(domain[z])*l + len(domain[z])*k + j].components[2].worth(0) for j in range(len(domain[z]))]) for k in range(len(domain[x]))]) for l in range(len(domain[y]))]) 
+    #evaluate the components on the whole grid at once
+    u, v, w = vect_eval_array(v_field, {x: x_vals, y: y_vals, z: z_vals})[:3]
 
     #plot
-    ax = plt.figure().add_subplot(projection='3d')
+    ax = get_axes(filename, '3d')
     ax.quiver(x_vals,y_vals,z_vals,u,v,w,length=0.1,normalize=True,**kwargs)
     ax.set_xlabel(x)
     ax.set_ylabel(y)
     ax.set_zlabel(z)
     
-    plt.show()
+    finish(ax, filename)
 
     return 0
\ No newline at end of file
@@ -3,275 +3,154 @@ import re
 
 '''
 Methods for turning user string input into symbolic expressions.
-Contains a tokenizer and converter to symbolic expression.
+Contains a tokenizer (lex) and an operator precedence parser,
+which builds the myexpr directly in one pass over the tokens
+without recursion, so there is no limit on size or nesting depth.
 For now does not simplify.
-'''
-functions = ['sin', 'cos', 'tan', 'e', 'log']
-functs = re.compile('|'.join(functions))
-pm = ['+', '-']
-
-def sanitize(s: str):
-        '''
-        for the specific use in conv_mon, helps extract exponent by removing extra bracketing and the asterisks
-        e.g. 2*x**{23} -> 23 (the variable and coefficient are removed in conv_mon)
-        '''
-        return s.replace('*', '').replace('{', '').replace('}', '').replace('(', '').replace(')', '').strip()
 
-def token_list():
+Grammar, from lowest to highest precedence:
+1. sums and differences: a + b, a - b -> add(a, mul(-1, b))
+2. products and fractions: a*b, a/b -> mul(a, pwr(b, -1))
+3. unary signs: -a -> mul(-1, a), negative numbers become constants, e.g. -3
+4. powers, right associative: a**b or a^b, so 2**3**2 = 2**(3**2) and -x**2 = -(x**2)
+5. numbers, variables, special functions like sin(a) and brackets (a) or {a}
+'''
+functions = {'sin': 'sin', 'cos': 'cos', 'tan': 'tan', 'exp': 'exp', 'e': 'exp', 'log': 'log'}
+
+#binary operators: symbol -> (precedence, right associative)
+binary = {'+': (1, False), '-': (1, False), '*': (2, False), '/': (2, False), '**': (4, True), '^': (4, True)}
+#precedence of unary signs, binds weaker than powers
+unary = 3
+brackets = {'(': ')', '{': '}'}
+
+token_re = re.compile(r'''
+    \s*(?:
+    (?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    |(?P<name>[A-Za-z_][A-Za-z_0-9]*)
+    |(?P<op>\*\*|[-+*/^(){}])
+    )''', re.VERBOSE)
+
+def lex(s: str) -> list:
     '''
-    Creates list contianing the uppercase Alphabet A-Z
-    from ASCII codes
+    Splits the input string into a list of tokens (kind, text),
+    where kind is 'num', 'name' or 'op'. Ends with the token ('end', '').
     '''
-    toks = []
-    for i in range(65,91):
-        toks.append(chr(i))
-    return toks
-
-def conv_mon(var: list, s: str, token_dict: dict = None):
+    tokens = []
+    pos = 0
+    s = s.rstrip()
+    while pos < len(s):
+        match = token_re.match(s, pos)
+        if match is None or match.lastgroup is None:
+            rest = s[pos:].lstrip()
+            raise Exception(f'Unexpected character "{rest[0]}" at position {len(s) - len(rest)} in "{s}".')
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        pos = match.end()
+    tokens.append(('end', ''))
+    return tokens
+
+def parse_expr(var: list, tokens: list, pos: int = 0):
     '''
-    for use in tokenize, converts expressions of the form: x, x**2, A + 1, sin(B) + C into myexpr
-    token_dict is dictionary of known tokens and their corresponding myexpr.
-
-    Checks all the possible cases:
-    1. only the variable
-    2. something of the form '1+TOKEN', '-3'
-    3. a token with a coefficient or power, e.g. 2*(TOKEN)**3
-    4. a product of tokens (TOKEN)*(TOKEN)
-    5. a special function 'sin(TOKEN)'
-
-    Due to the way tokenize() works, these are the only possible cases.
-    ''' 
-    split_s = s
-
-    signum = myexpr('const', '1')
-    #check if it's a variable
-    if s in var:
-        #it is only a variable, e.g. 'x' or 'y'
-        expr = myexpr('id',s)
-        return expr
-    #check if addition/substraction is present
-    if any(ch in pm for ch in s):
-        #there is addition
-        #or it's sth like '-3'
-        #check which sign is present
-        if '-' in s:
-            #if minus, then set according coeff
-            split_s = s.split('-')
-            signum = myexpr('const', '-1')
-        if '+' in s:
-            split_s = s.split('+')
-        #remove whitespaces after splitting
-        split_s = [el.strip() for el in split_s]
-        #this counter is for differentiating left side from right side in split_s
-        counter  = 0
-        buff = []
-        
-        for side in split_s:
-            #for '-3' split_s = ['','3']
-            if side == '':
-                counter += 1
-                continue
-            elif side != '':
-                if not any(t in side for t in token_dict):
-                    #no token present, so it must be a const
-                    #can't be only the variable since a plus or minus is present
-                    if counter == 1:
-                        temp_expr = myexpr('mul',signum,myexpr('const',side))
-                    else:
-                        temp_expr = myexpr('const',side)
+    Operator precedence parsing with two explicit stacks instead of recursion,
+    so the nesting depth is only limited by memory, e.g. ((((x+1)+1)+1)+1) with
+    thousands of brackets.
+    operands holds the myexpr built so far, operators holds pending binary
+    operators, unary signs and open brackets (possibly of a special function).
+    Before an operator is pushed, all operators on the stack that bind at least
+    as strongly are applied, which gives the same result as precedence climbing.
+    Returns (myexpr, position of the next token).
+    '''
+    operands = []
+    operators = []
+    expect_operand = True
+    while True:
+        kind, text = tokens[pos]
+        if expect_operand:
+            if kind == 'num':
+                operands.append(myexpr('const', text))
+                expect_operand = False
+            elif kind == 'name':
+                if text in var:
+                    operands.append(myexpr('id', text))
+                    expect_operand = False
+                elif text in functions and tokens[pos + 1][1] in brackets:
+                    pos += 1
+                    operators.append(('(', brackets[tokens[pos][1]], functions[text]))
                 else:
-                    #found token, recursive call eavluates the token
-                    if counter == 1:
-                        temp_temp_expr = conv_mon(var,side,token_dict)
-                        temp_expr = myexpr('mul',signum,temp_temp_expr)
-                    else:
-                        temp_expr = conv_mon(var,side,token_dict)
-                buff.append(temp_expr)
-            counter += 1
-        #if there are two things, add them
-        #else it's just sth like '-3'
-        if len(buff) == 2:
-            expr = myexpr('add',buff[0],buff[1])
+                    raise Exception(f'Unknown variable or function "{text}", the variables are {var}.')
+            elif text in brackets:
+                operators.append(('(', brackets[text], None))
+            elif text == '-' and tokens[pos + 1][0] == 'num' and tokens[pos + 2][1] not in ('**', '^'):
+                #negative number, e.g. -3
+                pos += 1
+                operands.append(myexpr('const', '-' + tokens[pos][1]))
+                expect_operand = False
+            elif text == '-':
+                operators.append(('neg', unary, True))
+            elif text != '+':
+                #a unary plus is skipped
+                raise Exception(f'Unexpected "{text or "end of input"}".')
         else:
-            expr = buff[0]
-        
-    else:
-        #check for special functions
-        sp_fct_srch = functs.search(s)
-        if sp_fct_srch:
-            #separate argument
-            beg, end = sp_fct_srch.span()
-            lit_arg = s[end+1:end+2]
-            #the argument is a token, so extract the expression
-            arg = token_dict[lit_arg]
-            if s[beg:end] == 'sin':
-                expr = myexpr('sin',arg)
-            if s[beg:end] == 'cos':
-                expr = myexpr('cos',arg)
-            if s[beg:end] == 'tan':
-                expr = myexpr('tan',arg)
-            if s[beg:end] == 'e':
-                expr = myexpr('exp',arg)
-        #check for tokens
-        elif any(t in s for t in list(token_dict.keys())):
-            for token in token_dict:
-                if token in s:
-                    beg, end = re.search(rf'\b{token}\b',s).span() #locate token
-                    temp = sanitize(s[end:])
-                    #check for division
-                    if '/' in temp:
-                        #it's TOKEN/temp
-                        #remove slash
-                        temp = temp.replace('/','')
-                        #check if a token is in temp
-                        if any(tk in temp for tk in list(token_dict.keys())):
-                            denominator = token_dict[temp]
-                        else:
-                            #convert exponent to myexpr
-                            denominator = myexpr('const',temp)
-                        expr = myexpr('mul',token_dict[token],myexpr('pwr',denominator,myexpr('const','-1')))
-                        return expr
-                    #check for multiplication of tokens
-                    if len(temp) != 0 and s[end+2:end+3] == '(':
-                        #it's of the form (TOKEN)*(TOKEN)
-                        expr = myexpr('mul',token_dict[token],token_dict[temp])
-                        return expr
-                    #check for exponent
-                    if len(temp) == 0:
-                        #if no exponent, set it it to 1, later we can check for it
-                        #avoid unnecessary exponentiation by 1
-                        power = 1
-                    else:
-                        #check if token in exponent
-                        if any(tk in temp for tk in list(token_dict.keys())):
-                            power = token_dict[temp]
-                        else:
-                            #convert exponent to myexpr
-                            power = myexpr('const',temp)
-                    #check for coefficient
-                    temp_coeff = sanitize(s[:beg])
-                    if len(temp_coeff) == 0:
-                        #no coeff found, set to 1, same as power
-                        coeff = 1
-                    else:
-                        #check if coeff is a token
-                        if temp_coeff in list(token_dict.keys()):
-                            coeff = token_dict[temp_coeff]
-                        else:
-                            #not a token, not a function -> has to be const
-                            coeff = myexpr('const', temp_coeff)
-                    #put together
-                    #goes through all cases
-                    if power == 1:
-                        if coeff == 1:
-                            expr = token_dict[token]
-                            break
-                        else:
-                            expr = myexpr('mul',coeff,token_dict[token])
-                            break
-                    else:
-                        if coeff == 1:
-                            expr = myexpr('pwr',token_dict[token],power)
-                            break
-                        else:
-                            expr = myexpr('mul',coeff,myexpr('pwr',token_dict[token],power))
-                            break
+            if kind == 'op' and text in binary:
+                prec, right_assoc = binary[text]
+                reduce(operands, operators, prec, right_assoc)
+                operators.append((text, prec, right_assoc))
+                expect_operand = True
+            elif text in brackets.values() and any(op[0] == '(' for op in operators):
+                reduce(operands, operators, 0, False)
+                _, close, fct = operators.pop()
+                if text != close:
+                    raise Exception(f'Expected "{close}" but found "{text}".')
+                if fct is not None:
+                    operands.append(myexpr(fct, operands.pop()))
+            else:
+                #end of the expression
+                reduce(operands, operators, 0, False)
+                if operators:
+                    raise Exception(f'Expected "{operators[-1][1]}" but found "{text or "end of input"}".')
+                return operands[0], pos
+        pos += 1
+
+def reduce(operands: list, operators: list, prec: int, right_assoc: bool):
+    '''
+    Applies the operators on top of the stack (up to the next open bracket)
+    that bind more strongly than an incoming operator of precedence prec,
+    or equally strongly if the incoming operator is left associative.
+    '''
+    while operators and operators[-1][0] != '(':
+        op, top_prec, _ = operators[-1]
+        if top_prec < prec or (top_prec == prec and right_assoc):
+            return
+        operators.pop()
+        if op == 'neg':
+            operands.append(myexpr('mul', myexpr('const', '-1'), operands.pop()))
         else:
-            #it's just a number
-            #or a fraction e.g. '2/3'
-            if '/' in s:
-                beg, end = re.search(r'\b/\b',s).span()
-                numerator = myexpr('const',s[:beg])
-                denominator = myexpr('const',s[end:])
-                expr = myexpr('mul',numerator,myexpr('pwr',denominator,myexpr('const','-1')))
-            else:    
-                expr = myexpr('const',s)
-    return expr
-
-        
+            right = operands.pop()
+            operands.append(combine(op, operands.pop(), right))
 
-def tokenize(var: list, s: str) -> dict:
+def combine(op: str, left: myexpr, right: myexpr) -> myexpr:
     '''
-    Converts user input expression 's' into a dictionary of the form
-
-    {Token: expression}
-
-    where Token comes from token_list() and expression is of the form myexpr(...).
-    Uses conv_mon() to convert string to myexpr.
-
-    Runs through string and finds innermost bracket -> the expr inside gets token and prio (int, depth of bracket).
-    Replaces all occurences of the expression with its token.
-    Goes up one level of prio higher.
-
-    e.g. s='2*x + sin(x*(exp(x)+1))'
-    1. brackets around whole expr to not lose the 2*x term: s -> (s)
-    2. brackets around ewach occurence of the variable: s -> '(2*(x) + sin((x)*(exp((x))+1)))'
-    3. prio levels and expressions would be: [[1,'x'] FROM 2*(x), [2,'x'] FROM sin((x)), [5, 'x'] FROM exp((x))] etc
-    4. assigns tokens: tokens = {'A': 'x' ...} 
-
-    last two things happen kinda simultaniously.
-
-    The lit_tokens and lit_buff are saving the str version of tokens and expression.
-    This makes it easier to replace all occurances of a token in the given string,
-    while simulataneaously converting the expression to myexpr and stroing it separately.
+    Builds the myexpr for a binary operator,
+    substraction and division are reduced to addition, multiplication and powers.
     '''
-    t_list = token_list()
-    lit_tokens = {}
-    tokens = {}
-    lit_buff = []
-    buff = []
-    l = []
-    stack = []
-
-    #brackets whole expression to prevent loss of terms
-    s = '(' + s + ')'
-
-    #replace 'exp' with 'e' so that if the var is x there is no confusion
-    s = s.replace('exp', 'e')
-
-    #bracktes variable(s) so they get their own tokens
-    for v in var:
-        s = s.replace(v,f'({v})')
-
-    for i, ch in enumerate(s):
-            if ch == '(':
-                stack.append(i)
-            elif ch == ')' and stack:
-                beg = stack.pop()
-                l.append([len(stack), s[beg+1:i]])
-    for j in range(len(l)):
-        if lit_buff and prio > l[j][0]:
-            for e in lit_buff:
-                #get key (token) of the value 'e' (the current expression in str) from lit_token
-                tkn = list(lit_tokens.keys())[list(lit_tokens.values()).index(e)]
-                l[j][1] = l[j][1].replace(e, tkn)
-                
-                #go through rest of expressions and replace each instance of current expression with its token
-                for q in range(j+1, len(l)):
-                    if e in l[q][1]:
-                        l[q][1] = l[q][1].replace(e, tkn)
-            
-            lit_buff.clear()
-            buff.clear()
-        prio = l[j][0]
-        lit_buff.append(l[j][1])
-
-        #tanslate expr into myexpr with conv_mon
-        expr = conv_mon(var,l[j][1],tokens)
-        buff.append(expr)
-
-        #update myexpr tokens dict
-        tokens.update({t_list[j]: expr})
-        #update lit tokens dict
-        lit_tokens.update({t_list[j]: l[j][1]})
-
-    return tokens      
+    if op == '+':
+        return myexpr('add', left, right)
+    if op == '-':
+        if right.op == 'const' and not right.left.startswith('-'):
+            return myexpr('add', left, myexpr('const', '-' + right.left))
+        return myexpr('add', left, myexpr('mul', myexpr('const', '-1'), right))
+    if op == '*':
+        return myexpr('mul', left, right)
+    if op == '/':
+        return myexpr('mul', left, myexpr('pwr', right, myexpr('const', '-1')))
+    return myexpr('pwr', left, right)
 
 def my_parser(var: list, s: str):
     '''
-    Wrapper for tokenize.
     Parses string to myexpr.
+    var is the list of variable names, e.g. my_parser(['x','y'], 'x**2 + sin(x*y)')
     '''
-    res_dict = tokenize(var,s)
-    res = list(res_dict.values())
-    return res[-1]
\ No newline at end of file
+    tokens = lex(s)
+    expr, pos = parse_expr(var, tokens)
+    if tokens[pos][0] != 'end':
+        raise Exception(f'Unexpected "{tokens[pos][1]}" after the end of the expression.')
+    return expr
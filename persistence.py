@@ -0,0 +1,226 @@
+'''
+Persistent on-disk cache for parsed and differentiated expressions.
+Parsing and differentiating the same formulas at every start of a program
+is replaced by loading the results from a directory, e.g.
+
+    cache = disk_cache('formula_cache')
+    term = cache.parse(['x','y'], 'x**2 + sin(x*y)')
+    dterm = cache.diff(['x','y'], 'x**2 + sin(x*y)', 'x', simplify=True)
+
+Entries are content addressed: the file name is a hash of the formula string,
+the list of variables, the library version (__version__ in expression.py)
+and what was computed from them, so a changed formula or a new version of
+the library never hits an old entry.
+Terms are stored with serialization.dumps in files <hash>.expr,
+tapes (see tape.py) as directories <hash>.tape of .npy files,
+which are memory-mapped when loaded with cache.load_tape(vars, s, var)
+and can be evaluated with tape_eval.
+
+The total size of the entries is bounded by maxbytes, if it is exceeded
+the least recently used entries (by modification time, which is updated on every hit)
+are deleted.
+Files are written to a temporary name and then renamed,
+so several processes can share one cache directory.
+'''
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import expression
+from expression import *
+from parsing import my_parser
+from derivatives import calc_diff
+from serialization import dumps, loads
+from tape import tape, to_tape
+
+
+class disk_cache:
+    '''
+    Cache of parsed terms, derivatives and tapes in the given directory,
+    which is created if necessary.
+    '''
+    def __init__(self, directory: str, maxbytes: int = 1 << 30):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        #total size of the entries, determined on the first write
+        self.size = None
+
+    def key(self, vars: list, s: str, var = None, simplify: bool = False) -> str:
+        '''
+        Hash of the formula, the variables, the library version and
+        the variable of the derivative (None for the parsed term).
+        '''
+        data = json.dumps([expression.__version__, s, list(vars), var, bool(simplify)])
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def parse(self, vars: list, s: str) -> myexpr:
+        '''
+        Cached my_parser(vars, s).
+        '''
+        return self.term(vars, s)
+
+    def diff(self, vars: list, s: str, var: str, simplify: bool = False) -> myexpr:
+        '''
+        Cached calc_diff(my_parser(vars, s), var, simplify=simplify).
+        '''
+        return self.term(vars, s, var, simplify)
+
+    def term(self, vars: list, s: str, var = None, simplify: bool = False) -> myexpr:
+        '''
+        Loads the parsed term (var = None) or its derivative w.r.t. var,
+        computes and stores it if it is not in the cache.
+        '''
+        path = os.path.join(self.directory, self.key(vars, s, var, simplify) + '.expr')
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            self.touch(path)
+            self.hits += 1
+            return loads(data)
+        except FileNotFoundError:
+            pass
+        self.misses += 1
+        if var is None:
+            res = my_parser(vars, s)
+        else:
+            res = calc_diff(self.parse(vars, s), var, simplify=simplify)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(dumps(res))
+        os.replace(tmp, path)
+        self.added(os.path.getsize(path))
+        return res
+
+    def load_tape(self, vars: list, s: str, var = None, simplify: bool = False) -> tape:
+        '''
+        Tape of the parsed term (var = None) or of its derivative w.r.t. var.
+        The arrays of a cached tape are memory-mapped read only,
+        so large tapes are not read into memory before they are used.
+        '''
+        path = os.path.join(self.directory, self.key(vars, s, var, simplify) + '.tape')
+        if os.path.isdir(path):
+            try:
+                res = read_tape(path)
+                self.touch(path)
+                self.hits += 1
+                return res
+            except FileNotFoundError:
+                #evicted by another process in the meantime
+                pass
+        self.misses += 1
+        res = to_tape(self.term(vars, s, var, simplify))
+        tmp = f'{path}.{os.getpid()}.tmp'
+        write_tape(res, tmp)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            #written by another process in the meantime
+            shutil.rmtree(tmp, ignore_errors=True)
+        else:
+            self.added(entry_size(path))
+        return res
+
+    def touch(self, path: str):
+        '''
+        Marks an entry as recently used.
+        '''
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def entries(self) -> list:
+        '''
+        List of (modification time, size, path) of all entries.
+        '''
+        res = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(('.expr', '.tape')):
+                try:
+                    res.append((entry.stat().st_mtime, entry_size(entry.path), entry.path))
+                except FileNotFoundError:
+                    pass
+        return res
+
+    def added(self, nbytes: int):
+        '''
+        Keeps track of the total size, evicts if it exceeds maxbytes.
+        '''
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.entries())
+        else:
+            self.size += nbytes
+        if self.size > self.maxbytes:
+            self.evict()
+
+    def evict(self):
+        '''
+        Deletes the least recently used entries until the size is below maxbytes.
+        '''
+        entries = sorted(self.entries())
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.maxbytes:
+                break
+            remove(path)
+            self.size -= size
+
+    def clear(self):
+        '''
+        Deletes all entries and resets the statistics.
+        '''
+        for _, _, path in self.entries():
+            remove(path)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def info(self) -> dict:
+        '''
+        Hit/miss statistics and size of the cache in bytes.
+        '''
+        size = sum(size for _, size, _ in self.entries())
+        return {'hits': self.hits, 'misses': self.misses, 'size': size, 'maxbytes': self.maxbytes}
+
+def entry_size(path: str) -> int:
+    '''
+    Size of a file or of all files in a directory.
+    '''
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path))
+    return os.path.getsize(path)
+
+def remove(path: str):
+    '''
+    Deletes an entry, if it still exists.
+    '''
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def write_tape(t: tape, path: str):
+    '''
+    Writes the arrays of a tape as .npy files and the names as json into the directory path.
+    '''
+    os.makedirs(path, exist_ok=True)
+    for name in ('ops', 'left', 'right', 'consts'):
+        np.save(os.path.join(path, name + '.npy'), getattr(t, name))
+    with open(os.path.join(path, 'names.json'), 'w') as f:
+        json.dump(t.names, f)
+
+def read_tape(path: str) -> tape:
+    '''
+    Reads a tape written by write_tape, with memory-mapped arrays.
+    '''
+    arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in ('ops', 'left', 'right', 'consts')]
+    with open(os.path.join(path, 'names.json')) as f:
+        names = json.load(f)
+    return tape(*arrays, names)
@@ -0,0 +1,161 @@
+'''
+Reverse mode (adjoint) automatic differentiation.
+Unlike vect_grad, which builds one symbolic derivative per variable,
+the gradient is computed numerically in two sweeps over the term:
+1. forward sweep: evaluate every node (array_eval from evaluation.py)
+2. backward sweep: go through the nodes from the root down to the variables
+   and pass on the adjoint d(term)/d(node) to the children with the
+   local derivative rules in the dict cases, defined at the end of the document.
+The cost is independent of the number of variables.
+'''
+import numpy as np
+from expression import *
+from evaluation import *
+from forward import dual
+
+
+def calc_grad(term: myexpr, vars: list, vals: dict):
+    '''
+    Gradient of term w.r.t. the variables in vars at the point(s) in vals.
+    vals is a dict {'variable': value} as for calc_eval_array, the values
+    can be floats or arrays of points.
+    Returns an ndarray of shape (len(vars),) + shape of the points,
+    the i-th entry being the partial derivative w.r.t. vars[i].
+    '''
+    return value_and_grad(term, vars, vals)[1]
+
+def value_and_grad(term: myexpr, vars: list, vals: dict):
+    '''
+    Same as calc_grad, but also returns the value of the term,
+    which is computed in the forward sweep anyway.
+    Returns (value, gradient).
+    '''
+    arrays, shape = as_arrays(vals)
+    values, grads = sweep(term, vars, arrays)
+    value = np.broadcast_to(values[id(term)], shape).copy()
+    grad = np.empty((len(vars),) + shape)
+    for i, v in enumerate(vars):
+        grad[i] = grads[v]
+    return value, grad
+
+def sweep(term: myexpr, vars: list, arrays: dict, values: dict = None):
+    '''
+    The forward and the backward sweep at the values in arrays.
+    Returns the dict of values id(node) -> value and the dict of
+    partial derivatives {'variable': d(term)/d(variable)}.
+    values can be the dict of a previous call at the same arrays,
+    then only the nodes that are not in it yet are evaluated.
+    The sweeps only use arithmetic and numpy functions,
+    so they work for duals (see forward.py) as well.
+    '''
+    order = postorder(term)
+
+    #forward sweep, values maps id(node) -> value
+    if values is None:
+        values = {}
+    array_eval(term, arrays, values)
+
+    #only nodes that depend on one of the vars need adjoints
+    active = active_nodes(order, vars)
+
+    #backward sweep, adjoints maps id(node) -> d(term)/d(node)
+    adjoints = {id(term): 1.0}
+    grads = {v: 0.0 for v in vars}
+    for node in reversed(order):
+        adj = adjoints.pop(id(node), None)
+        if adj is None or id(node) not in active:
+            continue
+        if node.op == 'id':
+            grads[node.left] = grads[node.left] + adj
+            continue
+        for child, contrib in cases[node.op](node, adj, values, active):
+            key = id(child)
+            if key not in active:
+                continue
+            adjoints[key] = adjoints[key] + contrib if key in adjoints else contrib
+    return values, grads
+
+def hvp(term: myexpr, vars: list, point: dict, v):
+    '''
+    Hessian-vector product H*v of term w.r.t. vars at point, without building the Hessian.
+    point is a dict {'variable': value} as for calc_grad (floats or arrays of points),
+    v is the direction, one entry (float or array) per variable in vars.
+    Forward over reverse: the sweeps of calc_grad are run on dual numbers
+    with the tangents v (see dual in forward.py), the tangent of the gradient
+    is the directional derivative of the gradient, i.e. H*v.
+    The cost is a small multiple of one gradient, for any number of variables.
+    Returns an ndarray of shape (len(vars),) + shape of the points.
+    '''
+    arrays, shape = as_arrays(point)
+    seeded = dict(arrays)
+    for var, direction in zip(vars, v):
+        if var not in arrays:
+            raise Exception(f'No values provided for variable "{var}".')
+        seeded[var] = dual(arrays[var], np.asarray(direction, dtype=float))
+    values, grads = sweep(term, vars, seeded)
+    res = np.zeros((len(vars),) + shape)
+    for i, var in enumerate(vars):
+        if isinstance(grads[var], dual) and grads[var].tan is not None:
+            res[i] = grads[var].tan
+    return res
+
+def active_nodes(order: list, vars: list) -> set:
+    '''
+    Returns the set of id(node) for all nodes that depend on at least one of vars.
+    order has to be a post order of the term, see postorder() in expression.py.
+    '''
+    active = set()
+    for node in order:
+        if node.op == 'id':
+            if node.left in vars:
+                active.add(id(node))
+        elif node.op != 'const':
+            if id(node.left) in active or (node.right is not None and id(node.right) in active):
+                active.add(id(node))
+    return active
+
+########################### local derivative rules ###################################
+#each rule receives the node, its adjoint, the forward values and the active set
+#and returns a list of (child, adjoint contribution) pairs
+
+def adj_add(term, adj, values, active):
+    return [(term.left, adj), (term.right, adj)]
+
+def adj_mul(term, adj, values, active):
+    res = []
+    #skip the product for a constant factor
+    if id(term.left) in active:
+        res.append((term.left, adj*values[id(term.right)]))
+    if id(term.right) in active:
+        res.append((term.right, adj*values[id(term.left)]))
+    return res
+
+def adj_pwr(term, adj, values, active):
+    base = values[id(term.left)]
+    exponent = values[id(term.right)]
+    res = [(term.left, adj*exponent*base**(exponent - 1))]
+    #the log is only needed (and only defined for positive bases) if the exponent is variable
+    if id(term.right) in active:
+        res.append((term.right, adj*values[id(term)]*np.log(base)))
+    return res
+
+def adj_exp(term, adj, values, active):
+    return [(term.left, adj*values[id(term)])]
+
+def adj_sin(term, adj, values, active):
+    return [(term.left, adj*np.cos(values[id(term.left)]))]
+
+def adj_cos(term, adj, values, active):
+    return [(term.left, -adj*np.sin(values[id(term.left)]))]
+
+def adj_tan(term, adj, values, active):
+    return [(term.left, adj/np.cos(values[id(term.left)])**2)]
+
+def adj_log(term, adj, values, active):
+    return [(term.left, adj/values[id(term.left)])]
+
+
+cases = {
+        'add': adj_add, 'mul': adj_mul, 'pwr': adj_pwr, 'exp': adj_exp,
+        'sin': adj_sin, 'cos': adj_cos, 'tan': adj_tan, 'log': adj_log
+        }
@@ -0,0 +1,142 @@
+'''
+Serialization of myexpr terms, to a compact binary format and to JSON.
+Several terms (e.g. all entries of a Jacobian) are stored together as one DAG:
+every distinct node is written once, no matter how many terms
+or parents share it, and the terms are the roots of the DAG.
+
+Binary format, all numbers little endian:
+magic     -- b'MYEXPR' and the format version (uint8)
+header    -- uint32: number of nodes, strings, roots, bytes of the strings, and 1 for a single term
+strings   -- uint32 lengths of the strings, then the utf-8 bytes
+             (the names of the variables and the values of the constants, each stored once)
+nodes     -- the nodes in post order as three arrays:
+             uint8 opcode, int32 left, int32 right, where left is the index in the strings
+             for id and const and the index of the child node otherwise, right is -1 if unused
+roots     -- int32 indices of the nodes of the terms
+
+Constants are kept as their strings, so a term comes back exactly as it was written.
+Both formats store the node list of to_dag in expression.py and are loaded with from_dag,
+i.e. the nodes are built through myexpr and hash consed as usual.
+'''
+import json
+import numpy as np
+from expression import *
+
+magic = b'MYEXPR'
+version = 1
+header = np.dtype('<u4')
+
+def as_list(terms):
+    '''
+    Returns (list of terms, whether a single term was given).
+    '''
+    if isinstance(terms, myexpr):
+        return [terms], True
+    return list(terms), False
+
+def dumps(terms) -> bytes:
+    '''
+    Binary serialization of a term or a list of terms, see above.
+    '''
+    terms, single = as_list(terms)
+    nodes, roots = to_dag(terms)
+    n = len(nodes)
+    ops = np.empty(n, dtype=np.uint8)
+    left = np.full(n, -1, dtype='<i4')
+    right = np.full(n, -1, dtype='<i4')
+    strings = {}
+    for i, (code, l, r) in enumerate(nodes):
+        ops[i] = code
+        if code == ID or code == CONST:
+            left[i] = strings.setdefault(l, len(strings))
+        else:
+            left[i] = l
+            if r is not None:
+                right[i] = r
+    roots = np.array(roots, dtype='<i4')
+    encoded = [s.encode('utf-8') for s in strings]
+    text = b''.join(encoded)
+    lengths = np.array([len(s) for s in encoded], dtype=header)
+    head = np.array([n, len(encoded), len(roots), len(text), single], dtype=header)
+    return b''.join([magic, bytes([version]), head.tobytes(), lengths.tobytes(), text,
+                     ops.tobytes(), left.tobytes(), right.tobytes(), roots.tobytes()])
+
+def loads(data: bytes):
+    '''
+    Inverse of dumps, returns a term or a list of terms.
+    '''
+    if data[:len(magic)] != magic:
+        raise Exception('Data is not a serialized myexpr.')
+    pos = len(magic)
+    if data[pos] != version:
+        raise Exception(f'Unsupported format version {data[pos]}, expected {version}.')
+    pos += 1
+
+    def take(dtype, count):
+        nonlocal pos
+        arr = np.frombuffer(data, dtype=dtype, count=count, offset=pos)
+        pos += arr.nbytes
+        return arr
+
+    n, n_strings, n_roots, n_text, single = take(header, 5).tolist()
+    lengths = take(header, n_strings).tolist()
+    strings = []
+    for length in lengths:
+        #lengths are in bytes, so the strings are decoded one by one
+        strings.append(bytes(data[pos:pos + length]).decode('utf-8'))
+        pos += length
+    ops = take(np.uint8, n).tolist()
+    left = take('<i4', n).tolist()
+    right = take('<i4', n).tolist()
+    roots = take('<i4', n_roots).tolist()
+
+    nodes = []
+    for op, l, r in zip(ops, left, right):
+        if op == ID or op == CONST:
+            nodes.append((op, strings[l], None))
+        else:
+            nodes.append((op, l, r if r >= 0 else None))
+    terms = from_dag(nodes, roots)
+    return terms[0] if single else terms
+
+def to_json(terms) -> str:
+    '''
+    JSON serialization of a term or a list of terms, of the form
+    {"version": 1, "single": true, "nodes": [["id", "x"], ["const", "2"], ["mul", 1, 0], ["sin", 2]], "roots": [3]}
+    with the nodes in post order, the children are given by their positions in the list,
+    "single" is true for a single term and false for a list of terms.
+    '''
+    terms, single = as_list(terms)
+    nodes, roots = to_dag(terms)
+    #right is None for leaves and unary nodes and then left out
+    nodes = [[tags[code], l] if r is None else [tags[code], l, r] for code, l, r in nodes]
+    return json.dumps({'version': version, 'single': single, 'nodes': nodes, 'roots': roots})
+
+def from_json(s: str):
+    '''
+    Inverse of to_json, returns a term or a list of terms.
+    '''
+    data = json.loads(s)
+    if data.get('version') != version:
+        raise Exception(f'Unsupported format version {data.get("version")}, expected {version}.')
+    nodes = []
+    for item in data['nodes']:
+        if item[0] not in tags:
+            raise Exception(f'Unknown expression type "{item[0]}".')
+        nodes.append((codes[item[0]], item[1], item[2] if len(item) > 2 else None))
+    terms = from_dag(nodes, data['roots'])
+    return terms[0] if data.get('single') else terms
+
+def save(terms, filename: str):
+    '''
+    Writes dumps(terms) to a file.
+    '''
+    with open(filename, 'wb') as f:
+        f.write(dumps(terms))
+
+def load(filename: str):
+    '''
+    Reads terms written by save.
+    '''
+    with open(filename, 'rb') as f:
+        return loads(f.read())
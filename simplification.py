@@ -0,0 +1,298 @@
+'''
+Algebraic simplification of myexpr terms, mainly for the output of calc_diff.
+Uses the dict cases = {'name of operation': rule}, defined at the end of the document.
+The rules are:
+1. constant folding, e.g. 2*3 -> 6, sin(0) -> 0
+2. identities with 0 and 1, e.g. x + 0 -> x, 1*x -> x, 0*x -> 0, x^1 -> x, x^0 -> 1
+3. nested sums and products are flattened, e.g. (x + 1) + (x + 2) is one sum of four terms
+4. like terms are collected, e.g. x + 2*x -> 3*x
+5. like factors are collected into powers, e.g. x*(x^2) -> x^3
+
+Sums are rebuilt as left-leaning chains with the constant last,
+products as const * (product of factors). Terms and factors are sorted by sort_key,
+so the result doesn't depend on the order of the operands, e.g. y + x and x + y
+simplify to the same node, and simplifying a simplified term returns it unchanged.
+'''
+import numpy as np
+import weakref
+from expression import *
+
+
+def calc_simplify(term: myexpr) -> myexpr:
+    '''
+    Simplifies a term using the rules in cases.
+    A whole nested sum (product) is gathered first and then simplified in one step,
+    so long sums don't get re-simplified at every level.
+    Works with an explicit stack, results for shared subterms are reused.
+    '''
+    done = {}
+    stack = [(term, None)]
+    while stack:
+        node, operands = stack.pop()
+        if id(node) in done:
+            continue
+        if operands is None:
+            operands = gather_operands(node)
+            todo = [op for op, mult in operands if id(op) not in done]
+            if todo:
+                stack.append((node, operands))
+                stack.extend((op, None) for op in todo)
+                continue
+        simple = [(done[id(op)], mult) for op, mult in operands]
+        done[id(node)] = cases[node.op](node, simple)
+    return done[id(term)]
+
+def gather_operands(term: myexpr) -> list:
+    '''
+    Returns the operands of a node as list of (operand, multiplicity).
+    For sums and products these are all operands of the maximal nested sum (product),
+    e.g. ((x + y) + x) -> [(x, 2), (y, 1)].
+    The multiplicities are counted without expanding shared subterms.
+    '''
+    if term.op in ('add', 'mul'):
+        return flatten(term, term.op)
+    if term.op in ('id', 'const'):
+        return []
+    if term.right is None:
+        return [(term.left, 1)]
+    return [(term.left, 1), (term.right, 1)]
+
+def flatten(term: myexpr, op: str) -> list:
+    '''
+    Operands with multiplicities of the maximal sub-DAG of term
+    consisting of nodes with tag op.
+    The multiplicities are pushed from the top down in reverse post order,
+    so a subterm shared n times is only visited once.
+    '''
+    #post order of the op-nodes
+    order = []
+    seen = set()
+    stack = [(term, False)]
+    while stack:
+        node, visited = stack.pop()
+        if visited:
+            order.append(node)
+            continue
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        stack.append((node, True))
+        for child in (node.right, node.left):
+            if child.op == op:
+                stack.append((child, False))
+
+    counts = {id(term): 1}
+    leaves = {}
+    for node in reversed(order):
+        mult = counts[id(node)]
+        for child in (node.left, node.right):
+            if child.op == op:
+                counts[id(child)] = counts.get(id(child), 0) + mult
+            elif id(child) in leaves:
+                leaves[id(child)][1] += mult
+            else:
+                leaves[id(child)] = [child, mult]
+    return [(leaf, mult) for leaf, mult in leaves.values()]
+
+############################ helpers #####################################################
+def const(val: float) -> myexpr:
+    '''
+    Constant term, integers are written without decimal point.
+    '''
+    val = float(val) + 0.0 #no negative zero
+    if val.is_integer():
+        return myexpr('const', str(int(val)))
+    return myexpr('const', repr(val))
+
+def value(term: myexpr):
+    '''
+    Value of a constant term, None for every other term.
+    '''
+    if term.op == 'const':
+        return float(term.left)
+    return None
+
+def fold(fct, *args):
+    '''
+    Folds a numerical function of constants into a constant.
+    Returns None if the result is not a (finite) real number, e.g. 0^(-1) or log(-1),
+    in which case the term is kept.
+    '''
+    try:
+        with np.errstate(all='ignore'):
+            res = fct(*args)
+    except (ZeroDivisionError, OverflowError, ValueError):
+        return None
+    if isinstance(res, complex) or not np.isfinite(res):
+        return None
+    return const(res)
+
+#node -> its sort key, weak like the hash consing table
+sort_keys = weakref.WeakKeyDictionary()
+
+def sort_key(term: myexpr) -> tuple:
+    '''
+    Structural key by which terms and factors are ordered: (opcode, keys of the children),
+    (opcode, name) for variables and (opcode, value, string) for constants,
+    e.g. x < y < 2*x < x^2 < sin(x).
+    Equal subterms are the same node and therefore have the same key object,
+    so comparing two keys only descends along their first difference.
+    Cached for every node, computed with an explicit stack.
+    '''
+    stack = [term]
+    while stack:
+        node = stack[-1]
+        if node in sort_keys:
+            stack.pop()
+            continue
+        if node.code is ID:
+            sort_keys[node] = (ID, node.left)
+        elif node.code is CONST:
+            sort_keys[node] = (CONST, float(node.left), node.left)
+        else:
+            todo = [child for child in (node.left, node.right) if child is not None and child not in sort_keys]
+            if todo:
+                stack.extend(todo)
+                continue
+            if node.right is None:
+                sort_keys[node] = (node.code, sort_keys[node.left])
+            else:
+                sort_keys[node] = (node.code, sort_keys[node.left], sort_keys[node.right])
+        stack.pop()
+    return sort_keys[term]
+
+def chain(op: str, terms: list) -> myexpr:
+    '''
+    Left-leaning chain of sums or products of the terms.
+    '''
+    res = terms[0]
+    for t in terms[1:]:
+        res = myexpr(op, res, t)
+    return res
+
+def split_coeff(term: myexpr):
+    '''
+    Splits a simplified term into (coefficient, rest), e.g. 3*x -> (3, x), x -> (1, x).
+    For constants rest is None.
+    '''
+    if term.op == 'const':
+        return float(term.left), None
+    if term.op == 'mul' and term.left.op == 'const':
+        return float(term.left.left), term.right
+    return 1.0, term
+
+def split_power(term: myexpr):
+    '''
+    Splits a simplified factor into (base, exponent) if the exponent is constant,
+    e.g. x^3 -> (x, 3), sin(x) -> (sin(x), 1).
+    '''
+    if term.op == 'pwr' and term.right.op == 'const':
+        return term.left, float(term.right.left)
+    return term, 1.0
+
+############################ rules #######################################################
+#each rule receives the original node and the list of its simplified operands
+#with their multiplicities and returns the simplified node
+
+def simp_leaf(term, operands):
+    return term
+
+def simp_add(term, operands):
+    coeffs = {}
+    rests = {}
+    total = 0.0
+    for op, mult in operands:
+        #an operand may have become a sum itself, e.g. 1*(x + y)
+        parts = flatten(op, 'add') if op.op == 'add' else [(op, 1)]
+        for part, m in parts:
+            c, rest = split_coeff(part)
+            if rest is None:
+                total += c*mult*m
+                continue
+            rests.setdefault(id(rest), rest)
+            coeffs[id(rest)] = coeffs.get(id(rest), 0.0) + c*mult*m
+
+    terms = []
+    for rest in sorted(rests.values(), key=sort_key):
+        c = coeffs[id(rest)]
+        if c == 0:
+            continue
+        terms.append(rest if c == 1 else myexpr('mul', const(c), rest))
+    if total != 0 or not terms:
+        terms.append(const(total))
+    return chain('add', terms)
+
+def simp_mul(term, operands):
+    coeff = 1.0
+    bases = {}
+    powers = {}
+    for op, mult in operands:
+        c, rest = split_coeff(op)
+        coeff *= c**mult
+        if rest is None:
+            continue
+        parts = flatten(rest, 'mul') if rest.op == 'mul' else [(rest, 1)]
+        for part, m in parts:
+            base, p = split_power(part)
+            bases.setdefault(id(base), base)
+            powers[id(base)] = powers.get(id(base), 0.0) + p*mult*m
+
+    if coeff == 0:
+        return const(0)
+    factors = []
+    for base in sorted(bases.values(), key=sort_key):
+        p = powers[id(base)]
+        if p == 0:
+            continue
+        factors.append(base if p == 1 else myexpr('pwr', base, const(p)))
+    if not factors:
+        return const(coeff)
+    product = chain('mul', factors)
+    if coeff == 1:
+        return product
+    return myexpr('mul', const(coeff), product)
+
+def simp_pwr(term, operands):
+    base, exponent = operands[0][0], operands[1][0]
+    b, e = value(base), value(exponent)
+    if e == 0:
+        return const(1)
+    if e == 1:
+        return base
+    if b == 1:
+        return const(1)
+    if b is not None and e is not None:
+        folded = fold(lambda u, v: u**v, b, e)
+        if folded is not None:
+            return folded
+    if e is not None and e.is_integer() and base.op == 'pwr' and base.right.op == 'const':
+        #(x^a)^n = x^(a*n) for integer n
+        return simp_pwr(term, [(base.left, 1), (const(e*float(base.right.left)), 1)])
+    return myexpr('pwr', base, exponent)
+
+def simp_fct(fct):
+    '''
+    Rule for special functions: folds constants, otherwise rebuilds the node.
+    '''
+    def rule(term, operands):
+        arg = operands[0][0]
+        if arg.op == 'const':
+            folded = fold(fct, float(arg.left))
+            if folded is not None:
+                return folded
+        return myexpr(term.op, arg)
+    return rule
+
+def simp_log(term, operands):
+    arg = operands[0][0]
+    if arg.op == 'exp':
+        #log(exp(a)) = a
+        return arg.left
+    return simp_fct(np.log)(term, operands)
+
+
+cases = {
+        'const': simp_leaf, 'id': simp_leaf, 'add': simp_add, 'mul': simp_mul,
+        'pwr': simp_pwr, 'exp': simp_fct(np.exp), 'sin': simp_fct(np.sin), 'cos': simp_fct(np.cos),
+        'tan': simp_fct(np.tan), 'log': simp_log
+        }
@@ -0,0 +1,214 @@
+'''
+Streaming evaluation of myexpr terms over data that doesn't fit into memory.
+The data is given as chunks, i.e. dicts {'variable': array} with (part of) the rows,
+either from any iterator or from columns, which are arrays (e.g. np.memmap)
+or .npy files that are memory-mapped, e.g.
+
+    out = eval_stream(term, {'x': 'x.npy', 'y': 'y.npy'}, out='result.npy')
+    grads = grad_stream(term, ['x', 'y'], arrow_chunks('data.arrow'), out='grads.arrow')
+
+Arrow IPC files are read record batch by record batch with arrow_chunks
+and written with out='name.arrow' (needs pyarrow).
+The columns reach the numpy functions without copying (float columns),
+the term (or its gradient, see grad_stream) is compiled once (see compiler.py)
+and then called on one chunk at a time.
+The compiled function deletes every temporary after its last use, so the memory
+needed is (largest number of temporaries alive at the same time + 1) arrays of
+the size of a chunk, whatever the size of the data, e.g. 4 chunks of 8 bytes
+per row for a sum of any number of terms like sin(x) + sin(2*x) + ...
+Terms nested deeply on the right side keep more temporaries alive, see gen_source.
+'''
+import os
+import numpy as np
+from expression import *
+from evaluation import as_arrays
+from compiler import calc_compile, calc_compile_grad
+
+#file extensions of Arrow IPC files
+arrow_extensions = ('.arrow', '.feather', '.ipc')
+
+
+def eval_chunks(term: myexpr, chunks):
+    '''
+    Evaluates the term on every chunk of an iterator of dicts {'variable': array}
+    and yields the results one by one, each of the (broadcast) shape of its chunk.
+    All variables of the term have to be in every chunk.
+    '''
+    names = sorted(calc_vars(term))
+    fct = calc_compile(term, names)
+    for vars in chunks:
+        for name in names:
+            if name not in vars:
+                raise Exception(f'No values provided for variable "{name}".')
+        arrays, _ = as_arrays({name: vars[name] for name in names})
+        shape = np.broadcast_shapes(*[np.shape(val) for val in vars.values()])
+        res = np.asarray(fct(*[arrays[name] for name in names]))
+        if res.shape != shape:
+            #constant terms come back as scalars
+            res = np.broadcast_to(res, shape)
+        yield res
+
+def open_columns(source: dict):
+    '''
+    Opens the columns of source = {'variable': array or filename of a .npy file},
+    the files memory-mapped read only. Returns the columns and their common length.
+    '''
+    columns = {}
+    for key, val in source.items():
+        if isinstance(val, (str, os.PathLike)):
+            val = np.load(val, mmap_mode='r')
+        columns[key] = val
+    lengths = {len(col) for col in columns.values()}
+    if len(lengths) != 1:
+        raise Exception(f'The columns have different lengths {sorted(lengths)}.')
+    return columns, lengths.pop()
+
+def chunks_of(source: dict, chunk: int = 1 << 20):
+    '''
+    Yields the columns of source (see open_columns) in chunks of chunk rows.
+    The chunks are views, of memory-mapped files only the rows of the
+    current chunk are read.
+    '''
+    columns, n = open_columns(source)
+    for start in range(0, n, chunk):
+        yield {key: col[start:start + chunk] for key, col in columns.items()}
+
+def as_chunks(source, chunk: int):
+    '''
+    Returns an iterator of chunks and the number of rows (None if unknown)
+    for a dict of columns or an iterator of chunks.
+    '''
+    if isinstance(source, dict):
+        return chunks_of(source, chunk), open_columns(source)[1]
+    return iter(source), None
+
+def eval_stream(term: myexpr, source, out = None, chunk: int = 1 << 20):
+    '''
+    Evaluates the term over all rows of source and writes the results into out.
+    source is either a dict of columns as for chunks_of, which are cut into
+    chunks of chunk rows, or any iterator of chunks (dicts {'variable': array}),
+    e.g. arrow_chunks.
+    out can be
+    - a preallocated array (e.g. np.memmap) with a row for every row of the source,
+    - the filename of a .npy file, which is created with the right size and memory-mapped
+      (only for a dict source, whose length is known),
+    - the filename of an Arrow IPC file (.arrow, .feather, .ipc) with the column 'result',
+      written chunk by chunk,
+    - None, then a new array is returned (which has to fit into memory).
+    Returns out.
+    '''
+    chunks, n = as_chunks(source, chunk)
+    results = (res[np.newaxis] for res in eval_chunks(term, chunks))
+    return store(results, n, out, ['result'], True)
+
+def grad_chunks(term: myexpr, vars: list, chunks):
+    '''
+    Gradient of the term w.r.t. vars on every chunk of an iterator of dicts
+    {'variable': array}, yields arrays of shape (len(vars),) + shape of the chunk.
+    The gradient is compiled once with calc_compile_grad (forward mode, see compiler.py).
+    '''
+    names = sorted(calc_vars(term))
+    fct = calc_compile_grad(term, names, vars)
+    for vars_chunk in chunks:
+        for name in names:
+            if name not in vars_chunk:
+                raise Exception(f'No values provided for variable "{name}".')
+        arrays, shape = as_arrays({key: val for key, val in vars_chunk.items() if key in names or key in vars})
+        res = np.empty((len(vars),) + shape)
+        for i, grad in enumerate(fct(*[arrays[name] for name in names])):
+            #structurally zero derivatives come back as scalars
+            res[i] = grad
+        yield res
+
+def grad_stream(term: myexpr, vars: list, source, out = None, chunk: int = 1 << 20):
+    '''
+    Gradient of term w.r.t. vars over all rows of source, computed chunk by chunk
+    with grad_chunks.
+    source and out as for eval_stream, the result has the shape (len(vars), rows),
+    an Arrow IPC file gets one column per variable.
+    The memory needed is bounded like for eval_stream, with the tangents of
+    each temporary for all variables, i.e. a few chunks per variable
+    (see gen_grad_source in compiler.py), however large the term.
+    Returns out.
+    '''
+    chunks, n = as_chunks(source, chunk)
+    return store(grad_chunks(term, vars, chunks), n, out, list(vars), False)
+
+def store(results, n, out, names: list, squeeze: bool):
+    '''
+    Writes the results, arrays of shape (len(names), rows of the chunk), into out
+    (see eval_stream), which has the shape (len(names), n), or (n,) if squeeze.
+    n is the number of rows of the source, None if it is not known in advance,
+    then a source that doesn't fit into out is detected at the first chunk too many.
+    '''
+    if isinstance(out, (str, os.PathLike)) and str(out).endswith(arrow_extensions):
+        write_arrow(out, names, results)
+        return out
+    if isinstance(out, (str, os.PathLike)):
+        if n is None:
+            raise Exception('Writing to a .npy file needs a dict of columns as source.')
+        shape = (n,) if squeeze else (len(names), n)
+        out = np.lib.format.open_memmap(out, mode='w+', dtype=np.float64, shape=shape)
+    elif out is None:
+        if n is None:
+            res = np.concatenate(list(results), axis=1)
+            return res[0] if squeeze else res
+        out = np.empty((n,) if squeeze else (len(names), n))
+
+    #rows of the results go into the columns of out
+    view = out[np.newaxis] if squeeze else out
+    if n is not None and n != view.shape[1]:
+        raise Exception(f'The source has {n} rows, but out has {view.shape[1]}.')
+    pos = 0
+    for res in results:
+        rows = res.shape[1]
+        if pos + rows > view.shape[1]:
+            #the rest of the source is not evaluated just to count its rows
+            raise Exception(f'The source has at least {pos + rows} rows, but out has {view.shape[1]}.')
+        view[:, pos:pos + rows] = res
+        pos += rows
+    if pos != view.shape[1]:
+        raise Exception(f'The source has {pos} rows, but out has {view.shape[1]}.')
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+######################## Arrow IPC files (optional, need pyarrow) ##########################
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise Exception('Arrow files need pyarrow, which is not installed.')
+    return pyarrow
+
+def arrow_chunks(filename: str, names: list = None):
+    '''
+    Yields the record batches of an Arrow IPC file as chunks {'column': array},
+    all columns or the ones in names. The file is memory-mapped and the columns
+    (of numbers, without nulls) are handed over to numpy without copying.
+    '''
+    pa = import_pyarrow()
+    reader = pa.ipc.open_file(pa.memory_map(str(filename), 'r'))
+    if names is None:
+        names = reader.schema.names
+    columns = [reader.schema.get_field_index(name) for name in names]
+    for name, j in zip(names, columns):
+        if j < 0:
+            raise Exception(f'No column "{name}" in {filename}.')
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        yield {name: batch.column(j).to_numpy(zero_copy_only=False) for name, j in zip(names, columns)}
+
+def write_arrow(filename: str, names: list, results):
+    '''
+    Writes the results, arrays of shape (len(names), rows of the chunk),
+    into an Arrow IPC file, one record batch per chunk and one float64 column per name.
+    '''
+    pa = import_pyarrow()
+    schema = pa.schema([(name, pa.float64()) for name in names])
+    with pa.OSFile(str(filename), 'wb') as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for res in results:
+                arrays = [pa.array(np.ascontiguousarray(row, dtype=np.float64)) for row in res]
+                writer.write_batch(pa.record_batch(arrays, schema=schema))
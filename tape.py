@@ -0,0 +1,111 @@
+'''
+Compact array-backed representation of myexpr terms, the tape.
+The nodes of a term are stored in post order (children before parents)
+in three numpy arrays, one entry per distinct node:
+ops   -- int8, the opcode of the node (see opcode in expression.py)
+left  -- int32, index of the left child in the tape,
+         for constants the index in the constant pool, for variables the index in names
+right -- int32, index of the right child, -1 for nodes with only one argument
+The constants are kept in a float64 pool and the variable names in a list.
+The last node is the root.
+
+A node costs 9 bytes, instead of a python object with its attributes.
+Shared subterms (see hash consing in expression.py) are stored once.
+'''
+import numpy as np
+from expression import *
+from evaluation import as_arrays
+from simplification import const
+
+
+class tape:
+    '''
+    Holds the arrays ops, left, right, consts and the list names, see above.
+    Create it with to_tape(term), turn it back with from_tape(tape).
+    '''
+    def __init__(self, ops, left, right, consts, names):
+        self.ops = ops
+        self.left = left
+        self.right = right
+        self.consts = consts
+        self.names = names
+
+    def __len__(self):
+        return len(self.ops)
+
+    def nbytes(self) -> int:
+        '''
+        Memory of the arrays in bytes.
+        '''
+        return self.ops.nbytes + self.left.nbytes + self.right.nbytes + self.consts.nbytes
+
+    def __repr__(self):
+        return f'tape({len(self)} nodes, {len(self.consts)} constants, variables {self.names})'
+
+def to_tape(term: myexpr) -> tape:
+    '''
+    Converts a term into a tape.
+    Equal constants and variables share one entry in the pool.
+    '''
+    order = postorder(term)
+    n = len(order)
+    ops = np.empty(n, dtype=np.int8)
+    left = np.full(n, -1, dtype=np.int32)
+    right = np.full(n, -1, dtype=np.int32)
+    consts = {}
+    names = {}
+    index = {}
+    for i, node in enumerate(order):
+        ops[i] = node.code
+        if node.op == 'const':
+            left[i] = consts.setdefault(float(node.left), len(consts))
+        elif node.op == 'id':
+            left[i] = names.setdefault(node.left, len(names))
+        else:
+            left[i] = index[id(node.left)]
+            if node.right is not None:
+                right[i] = index[id(node.right)]
+        index[id(node)] = i
+    return tape(ops, left, right, np.array(list(consts), dtype=np.float64), list(names))
+
+def from_tape(t: tape) -> myexpr:
+    '''
+    Converts a tape back into a term.
+    Constants are written as in calc_simplify, e.g. 2.0 -> '2'.
+    '''
+    nodes = []
+    consts = t.consts.tolist()
+    for op, l, r in zip(t.ops.tolist(), t.left.tolist(), t.right.tolist()):
+        if op == CONST:
+            nodes.append(const(consts[l]))
+        elif op == ID:
+            nodes.append(myexpr('id', t.names[l]))
+        else:
+            nodes.append(myexpr(tags[op], nodes[l], nodes[r] if r >= 0 else None))
+    return nodes[-1]
+
+def tape_eval(t: tape, vars: dict):
+    '''
+    Evaluates a tape at the values in vars = {'variable': value},
+    the values can be floats or arrays, as for calc_eval_array.
+    A single loop over the tape, every node is evaluated once.
+    '''
+    arrays, shape = as_arrays(vars)
+    for name in t.names:
+        if name not in arrays:
+            raise Exception(f'No values provided for variable "{name}".')
+    inputs = [arrays[name] for name in t.names]
+    consts = t.consts.tolist()
+    fcts = [numeric.get(tag) for tag in tags]
+    values = []
+    for op, l, r in zip(t.ops.tolist(), t.left.tolist(), t.right.tolist()):
+        if op == CONST:
+            values.append(consts[l])
+        elif op == ID:
+            values.append(inputs[l])
+        else:
+            values.append(fcts[op](values[l], values[r] if r >= 0 else None))
+    res = np.asarray(values[-1])
+    if res.shape != shape:
+        res = np.broadcast_to(res, shape).copy()
+    return res
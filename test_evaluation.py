@@ -0,0 +1,45 @@
+'''
+Tests of calc_eval and the worth of terms: the plan of all given variables,
+the string results for missing variables and deep terms.
+'''
+import math
+import numpy as np
+import pytest
+from expression import *
+from parsing import my_parser
+from evaluation import calc_eval, calc_eval_array
+
+def test_values():
+    term = my_parser(['x', 'y'], '(x + 1)*(y + 2) + sin(x)**2 - log(y)/x')
+    expected = 2.5*4 + math.sin(1.5)**2 - math.log(2)/1.5
+    assert calc_eval(term, {'x': 1.5, 'y': 2}) == pytest.approx(expected)
+    #the memo path gives the same
+    assert calc_eval(term, {'x': 1.5, 'y': 2}, {}) == pytest.approx(expected)
+    assert term.worth(2.0) == pytest.approx(calc_eval(term, {'x': 2.0, 'y': 2.0}))
+    x = np.linspace(1, 2, 5)
+    assert np.allclose(calc_eval(term, {'x': x, 'y': 2}), calc_eval_array(term, {'x': x, 'y': 2}))
+
+def test_missing_variable():
+    term = my_parser(['x', 'y'], 'x + y')
+    assert calc_eval(term, {'x': 1}) == '1.0 + y'
+
+def test_leaves():
+    assert myexpr('const', '2.5').worth(7) == 2.5
+    assert myexpr('id', 'x').worth(7) == 7.0
+    assert calc_eval(myexpr('id', 'x'), {'x': 3}) == 3.0
+
+def test_power():
+    #np.power like the compiled and the array evaluation
+    with np.errstate(all='ignore'):
+        assert calc_eval(my_parser(['x'], 'x^(-1)'), {'x': 0.0}) == np.inf
+        assert np.isnan(my_parser(['x'], 'x^(0.5)').worth(-1.0))
+
+def test_deep():
+    term = myexpr('id', 'x')
+    for _ in range(100000):
+        term = myexpr('sin', term)
+    value = 0.5
+    for _ in range(100000):
+        value = math.sin(value)
+    assert term.worth(0.5) == pytest.approx(value)
+    assert calc_eval(term, {'x': 0.5}) == pytest.approx(value)
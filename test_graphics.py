@@ -0,0 +1,67 @@
+'''
+Tests of adaptive_sample in graphics.py: the budget, the accuracy and the breaks at poles.
+'''
+import numpy as np
+import pytest
+import matplotlib
+matplotlib.use('Agg')
+import graphics
+from graphics import adaptive_sample
+from parsing import my_parser
+from evaluation import calc_eval_array
+
+@pytest.fixture
+def evals(monkeypatch):
+    '''
+    Counts the points at which adaptive_sample evaluates.
+    '''
+    count = [0]
+    def counting(term, vars):
+        count[0] += np.size(next(iter(vars.values())))
+        return calc_eval_array(term, vars)
+    monkeypatch.setattr(graphics, 'calc_eval_array', counting)
+    return count
+
+def sample(s, interval, **kwargs):
+    with np.errstate(all='ignore'):
+        return adaptive_sample(my_parser(['x'], s), 'x', interval, **kwargs)
+
+def max_error(s, interval, xs, ys):
+    fine = np.linspace(*interval, 100001)
+    exact = calc_eval_array(my_parser(['x'], s), {'x': fine})
+    return np.max(np.abs(np.interp(fine, xs, ys) - exact))
+
+@pytest.mark.parametrize('max_evals, derivative', [(5, False), (5, True), (50, False), (50, True), (2000, True)])
+def test_budget(evals, max_evals, derivative):
+    xs, ys = sample('sin(1/x)', [0.01, 1], max_evals=max_evals, derivative=derivative)
+    assert evals[0] <= max(max_evals, 4)
+    assert len(xs) >= 2
+
+def test_constant(evals):
+    xs, ys = sample('2', [0, 1])
+    assert evals[0] == 2
+    assert list(xs) == [0, 1] and list(ys) == [2, 2]
+
+@pytest.mark.parametrize('derivative', [False, True])
+def test_no_aliasing(derivative):
+    #the 17 initial points hit sin(20*x) at nearly the same phase
+    xs, ys = sample('sin(20*x)', [0, 10], derivative=derivative)
+    assert max_error('sin(20*x)', [0, 10], xs, ys) < 0.01
+
+@pytest.mark.parametrize('s, interval, kwargs', [
+    ('x*sin(x)', [0, 2000], {'derivative': True}),
+    ('x*sin(x)', [0, 20000], {}),
+    ('sin(x)', [0, 10], {'max_evals': 5}),
+])
+def test_no_breaks_without_pole(s, interval, kwargs):
+    #curves left coarse because the budget ran out are not broken
+    xs, ys = sample(s, interval, **kwargs)
+    assert not np.any(np.isnan(ys))
+
+@pytest.mark.parametrize('max_evals', [200, 2000])
+@pytest.mark.parametrize('derivative', [False, True])
+def test_breaks_at_poles(max_evals, derivative):
+    xs, ys = sample('tan(x)', [-5, 5], max_evals=max_evals, derivative=derivative)
+    breaks = xs[np.isnan(ys)]
+    assert len(breaks) == 4
+    assert np.allclose(breaks, [-1.5*np.pi, -0.5*np.pi, 0.5*np.pi, 1.5*np.pi], atol=0.1)
@@ -0,0 +1,73 @@
+'''
+Regression tests for the parser: strings are parsed and evaluated,
+the results are compared with the same formula evaluated by python.
+'''
+import math
+import pytest
+from expression import *
+from parsing import my_parser
+from evaluation import calc_eval
+
+point = {'x': 0.7, 'y': -1.3}
+
+cases = [
+    #precedence
+    ('1 + 2*3', 7),
+    ('1 - 2 - 3', -4),
+    ('2*3 + 4*5', 26),
+    ('(1 + 2)*3', 9),
+    #powers, right associative
+    ('2**3**2', 512),
+    ('2^3^2', 512),
+    ('(2**3)**2', 64),
+    ('x**2*y', 0.7**2*-1.3),
+    #unary minus
+    ('-x**2', -0.7**2),
+    ('-3**2', -9),
+    ('--x', 0.7),
+    ('2*-3', -6),
+    ('-x + y', -0.7 - 1.3),
+    ('x - -y', 0.7 - 1.3),
+    #division
+    ('1/2', 0.5),
+    ('8/2/2', 2),
+    ('x/y*2', 0.7/-1.3*2),
+    #brackets
+    ('{x + 1}*(y - 1)', 1.7*-2.3),
+    ('{(x)}', 0.7),
+    #functions
+    ('e(x)', math.exp(0.7)),
+    ('exp(x) - e(x)', 0),
+    ('sin(x)**2 + cos(x)**2', 1),
+    ('log(e(y))', -1.3),
+    ('2*tan(x/2)', 2*math.tan(0.35)),
+    #numbers
+    ('1.5e2 + .5', 150.5),
+]
+
+@pytest.mark.parametrize('s, expected', cases)
+def test_parse_eval(s, expected):
+    term = my_parser(['x', 'y'], s)
+    assert calc_eval(term, point) == pytest.approx(expected)
+
+def test_shared_nodes():
+    #the same subterm is parsed into the same (hash consed) node
+    term = my_parser(['x'], 'sin(x) + sin(x)')
+    assert term.left is term.right
+
+errors = [
+    ('x + z', 'Unknown variable or function "z"'),
+    ('(x + 1}', 'Expected "\\)" but found "}"'),
+    ('x + 1)', 'Unexpected "\\)" after the end of the expression'),
+    ('x $ 1', 'Unexpected character "\\$" at position 2'),
+    ('x +', 'Unexpected "end of input"'),
+    ('*x', 'Unexpected "\\*"'),
+    ('sin x', 'Unknown variable or function "sin"'),
+    ('3x', 'Unexpected "x" after the end of the expression'),
+    ('(x + 1', 'Expected "\\)" but found "end of input"'),
+]
+
+@pytest.mark.parametrize('s, message', errors)
+def test_parse_errors(s, message):
+    with pytest.raises(Exception, match=message):
+        my_parser(['x', 'y'], s)
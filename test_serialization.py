@@ -0,0 +1,82 @@
+'''
+Round trip tests for the binary and the JSON format of serialization.py.
+'''
+import json
+import pytest
+from expression import *
+from parsing import my_parser
+from serialization import dumps, loads, to_json, from_json, save, load
+
+formats = [(dumps, loads), (to_json, from_json)]
+
+def terms():
+    x = myexpr('id', 'x')
+    shared = myexpr('sin', myexpr('mul', x, myexpr('const', '2.50')))
+    first = myexpr('add', shared, myexpr('pwr', shared, myexpr('const', '-1')))
+    second = myexpr('mul', shared, my_parser(['x', 'y'], 'exp(y) - log(x)/3'))
+    return shared, first, second
+
+@pytest.mark.parametrize('write, read', formats)
+def test_single(write, read):
+    _, first, _ = terms()
+    res = read(write(first))
+    assert isinstance(res, myexpr)
+    #nodes are hash consed, so an equal term is the same object
+    assert res is first
+    assert str(res) == str(first)
+
+@pytest.mark.parametrize('write, read', formats)
+def test_list(write, read):
+    shared, first, second = terms()
+    res = read(write([first, second, first]))
+    assert isinstance(res, list)
+    assert res == [first, second, first]
+    assert all(a is b for a, b in zip(res, [first, second, first]))
+    #one element lists stay lists
+    assert read(write([second])) == [second]
+    assert read(write([])) == []
+
+@pytest.mark.parametrize('write, read', formats)
+def test_shared_subterms(write, read):
+    shared, first, second = terms()
+    res = read(write([first, second]))
+    assert res[0].left is res[0].right.left is res[1].left
+    #every distinct node is written once
+    data = json.loads(to_json([first, second]))
+    assert len(data['nodes']) == len(collect_nodes([first, second]))
+
+def collect_nodes(terms):
+    seen = set()
+    for term in terms:
+        postorder(term, seen)
+    return seen
+
+def test_constants_unchanged():
+    term = myexpr('add', myexpr('const', '2.50'), myexpr('const', '1e-3'))
+    assert str(loads(dumps(term))) == str(term)
+    assert str(from_json(to_json(term))) == str(term)
+
+def test_file(tmp_path):
+    _, first, second = terms()
+    save([first, second], tmp_path / 'terms.expr')
+    assert load(tmp_path / 'terms.expr') == [first, second]
+
+def test_version():
+    _, first, _ = terms()
+    data = bytearray(dumps(first))
+    data[6] = 99
+    with pytest.raises(Exception, match='Unsupported format version 99'):
+        loads(bytes(data))
+    data = json.loads(to_json(first))
+    data['version'] = 99
+    with pytest.raises(Exception, match='Unsupported format version 99'):
+        from_json(json.dumps(data))
+    del data['version']
+    with pytest.raises(Exception, match='Unsupported format version None'):
+        from_json(json.dumps(data))
+    with pytest.raises(Exception, match='not a serialized myexpr'):
+        loads(b'nothing')
+    data = json.loads(to_json(first))
+    data['nodes'][0][0] = 'cosh'
+    with pytest.raises(Exception, match='Unknown expression type "cosh"'):
+        from_json(json.dumps(data))
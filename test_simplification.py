@@ -0,0 +1,79 @@
+'''
+Tests of calc_simplify: the rules, the canonical order of terms and factors
+and that simplifying a simplified term returns the same node.
+'''
+import numpy as np
+import pytest
+from expression import *
+from parsing import my_parser
+from evaluation import calc_eval
+from derivatives import calc_diff
+from simplification import calc_simplify
+
+def simp(s):
+    return calc_simplify(my_parser(['x', 'y'], s))
+
+rules = [
+    #constant folding
+    ('2*3', '6'),
+    ('sin(0) + 2^3', '8'),
+    ('0^(-1)', '(0)^(-1)'),
+    ('log(-1)', 'log(-1)'),
+    #identities with 0 and 1
+    ('x + 0', 'x'),
+    ('1*x', 'x'),
+    ('0*sin(x)', '0'),
+    ('x^1', 'x'),
+    ('x^0', '1'),
+    ('1^x', '1'),
+    ('log(exp(x))', 'x'),
+    #like terms and like factors
+    ('x + 2*x', '(3)*(x)'),
+    ('x - x', '0'),
+    ('(x + 1) + (x + 2)', '(2)*(x) + 3'),
+    ('x*x^2', '(x)^(3)'),
+    ('x/x', '1'),
+    ('(x^2)^3', '(x)^(6)'),
+    ('2*x*3*y', '(6)*((x)*(y))'),
+]
+
+@pytest.mark.parametrize('s, expected', rules)
+def test_rules(s, expected):
+    assert str(simp(s)) == expected
+
+def test_order():
+    #the result doesn't depend on the order of the operands
+    assert simp('y + x + 1') is simp('1 + x + y') is simp('x + (1 + y)')
+    assert simp('sin(x)*y*x') is simp('x*sin(x)*y')
+    assert simp('x*x + y + x') is simp('x + x^2 + y')
+    #the constant comes last in sums and first in products
+    assert str(simp('2 + sin(x) + x')) == 'x + sin(x) + 2'
+    assert str(simp('y*2*x')) == '(2)*((x)*(y))'
+
+terms = ['sin(x*x + y + x)', 'x*sin(x)*exp(y)', 'log(x*y)/(x + y)**2', 'tan(x)^x', 'cos(x + y)*sin(x - y)']
+
+@pytest.mark.parametrize('s', terms)
+def test_idempotent(s):
+    term = my_parser(['x', 'y'], s)
+    for var in 'xyxy':
+        term = calc_diff(term, var)
+        res = calc_simplify(term)
+        assert calc_simplify(res) is res
+        point = {'x': 0.7, 'y': 1.3}
+        assert calc_eval(res, point) == pytest.approx(calc_eval(term, point))
+
+def test_higher_derivative():
+    term = my_parser(['x'], 'exp(x*sin(x))')
+    simple = term
+    for _ in range(6):
+        term = calc_diff(term, 'x')
+        simple = calc_diff(simple, 'x', simplify=True)
+    assert calc_simplify(simple) is simple
+    assert len(postorder(simple)) < len(postorder(term))
+    assert simple.worth(0.7) == pytest.approx(term.worth(0.7))
+
+def test_deep():
+    term = myexpr('id', 'x')
+    for _ in range(100000):
+        term = myexpr('add', term, myexpr('const', '1'))
+    assert str(calc_simplify(term)) == 'x + 100000'
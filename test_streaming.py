@@ -0,0 +1,133 @@
+'''
+Tests of the streaming evaluation in streaming.py and of the compiled functions it uses.
+'''
+import tracemalloc
+import numpy as np
+import pytest
+from expression import *
+from parsing import my_parser
+from evaluation import calc_eval_array
+from compiler import calc_compile, calc_compile_grad
+from reverse import calc_grad
+from tape import to_tape, tape_eval
+from streaming import eval_stream, grad_stream, arrow_chunks
+
+def test_compiled_values():
+    term = my_parser(['x', 'y'], 'sin(x)*sin(x) + x/y - (x + y)**-2 + 3')
+    x = np.linspace(0.1, 2, 50)
+    y = np.linspace(1, 3, 50)
+    fct = calc_compile(term, ['x', 'y'])
+    assert np.allclose(fct(x, y), calc_eval_array(term, {'x': x, 'y': y}))
+    assert fct(1.0, 2.0) == pytest.approx(calc_eval_array(term, {'x': 1.0, 'y': 2.0}))
+
+def test_compiled_power():
+    #compiled, tape and array evaluation agree on powers that are not real numbers
+    x = np.array([1.0, 2.0])
+    for s, expected in [('x + 0^(-2)', np.inf), ('x*(-1)^(0.5)', np.nan)]:
+        term = my_parser(['x'], s)
+        with np.errstate(all='ignore'):
+            results = [calc_compile(term, ['x'])(1.0), calc_compile(term, ['x'])(x),
+                       tape_eval(to_tape(term), {'x': x}), calc_eval_array(term, {'x': x})]
+        for res in results:
+            assert np.all(np.isnan(res)) if np.isnan(expected) else np.all(res == expected)
+
+def test_bounded_memory():
+    #a sum of many terms keeps only a few temporaries alive, not one per node
+    term = my_parser(['x'], ' + '.join(f'sin({k}*x)' for k in range(1, 201)))
+    chunk = 50000
+    x = np.linspace(0, 1, 4*chunk)
+    out = np.empty_like(x)
+    eval_stream(term, {'x': x}, out=out, chunk=chunk)
+    tracemalloc.start()
+    try:
+        eval_stream(term, {'x': x}, out=out, chunk=chunk)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 6*8*chunk
+    assert np.allclose(out, calc_eval_array(term, {'x': x}))
+
+def test_bounded_memory_grad():
+    #forward mode tangents are freed like the values, no array is kept per node
+    term = my_parser(['x', 'y'], ' + '.join(f'sin({k}*x*y)' for k in range(1, 201)))
+    chunk = 50000
+    x = np.linspace(0, 1, 2*chunk)
+    y = np.linspace(1, 2, 2*chunk)
+    out = np.empty((2, len(x)))
+    grad_stream(term, ['x', 'y'], {'x': x, 'y': y}, out=out, chunk=chunk)
+    tracemalloc.start()
+    try:
+        grad_stream(term, ['x', 'y'], {'x': x, 'y': y}, out=out, chunk=chunk)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 16*8*chunk
+    assert np.allclose(out, calc_grad(term, ['x', 'y'], {'x': x, 'y': y}))
+
+def test_compiled_grad():
+    term = my_parser(['x', 'y'], 'x**y + tan(x)*cos(y) - log(x)/exp(y) + 2')
+    x = np.linspace(0.1, 1, 20)
+    y = np.linspace(-1, 2, 20)
+    fct = calc_compile_grad(term, ['x', 'y'], ['y', 'z', 'x'])
+    dy, dz, dx = fct(x, y)
+    expected = calc_grad(term, ['y', 'x'], {'x': x, 'y': y})
+    assert np.allclose(dy, expected[0]) and np.allclose(dx, expected[1])
+    assert dz == 0.0
+
+def test_wrong_length():
+    term = my_parser(['x'], 'x + 1')
+    x = np.arange(10.0)
+    with pytest.raises(Exception, match='The source has 10 rows, but out has 8'):
+        eval_stream(term, {'x': x}, out=np.empty(8), chunk=4)
+    chunks = ({'x': x[i:i + 4]} for i in range(0, 10, 4))
+    with pytest.raises(Exception, match='The source has at least 10 rows, but out has 8'):
+        eval_stream(term, chunks, out=np.empty(8))
+    chunks = ({'x': x[i:i + 4]} for i in range(0, 10, 4))
+    with pytest.raises(Exception, match='The source has 10 rows, but out has 12'):
+        eval_stream(term, chunks, out=np.empty(12))
+
+def test_chunks():
+    term = my_parser(['x', 'y'], 'x*y + 2')
+    x = np.arange(10.0)
+    res = eval_stream(term, {'x': x, 'y': 2*x}, chunk=3)
+    assert np.allclose(res, 2*x*x + 2)
+    chunks = ({'x': x[i:i + 3], 'y': 2.0} for i in range(0, 10, 3))
+    assert np.allclose(eval_stream(term, chunks), 2*x + 2)
+
+def test_npy_round_trip(tmp_path):
+    term = my_parser(['x', 'y'], 'x**2*y')
+    x = np.linspace(0, 1, 25)
+    np.save(tmp_path / 'x.npy', x)
+    np.save(tmp_path / 'y.npy', 3*x)
+    source = {'x': tmp_path / 'x.npy', 'y': tmp_path / 'y.npy'}
+    eval_stream(term, source, out=tmp_path / 'res.npy', chunk=7)
+    assert np.allclose(np.load(tmp_path / 'res.npy'), 3*x**3)
+    grad_stream(term, ['x', 'y'], source, out=tmp_path / 'grad.npy', chunk=7)
+    assert np.allclose(np.load(tmp_path / 'grad.npy'), [6*x**2, x**2])
+
+def test_arrow_round_trip(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    import pyarrow.ipc
+    x = np.linspace(0, 1, 25)
+    schema = pa.schema([('x', pa.float64()), ('y', pa.float64())])
+    with pa.OSFile(str(tmp_path / 'data.arrow'), 'wb') as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for i in range(0, 25, 10):
+                writer.write_batch(pa.record_batch([pa.array(x[i:i + 10]), pa.array(3*x[i:i + 10])], schema=schema))
+
+    chunks = list(arrow_chunks(tmp_path / 'data.arrow'))
+    assert [len(chunk['x']) for chunk in chunks] == [10, 10, 5]
+    assert np.allclose(np.concatenate([chunk['y'] for chunk in chunks]), 3*x)
+    with pytest.raises(Exception, match='No column "z"'):
+        next(arrow_chunks(tmp_path / 'data.arrow', ['z']))
+
+    term = my_parser(['x', 'y'], 'x**2*y')
+    eval_stream(term, arrow_chunks(tmp_path / 'data.arrow'), out=tmp_path / 'res.arrow')
+    res = list(arrow_chunks(tmp_path / 'res.arrow'))
+    assert [len(chunk['result']) for chunk in res] == [10, 10, 5]
+    assert np.allclose(np.concatenate([chunk['result'] for chunk in res]), 3*x**3)
+
+    grad_stream(term, ['x', 'y'], arrow_chunks(tmp_path / 'data.arrow'), out=tmp_path / 'grad.feather')
+    res = list(arrow_chunks(tmp_path / 'grad.feather', ['y', 'x']))
+    assert np.allclose(np.concatenate([chunk['x'] for chunk in res]), 6*x**2)
+    assert np.allclose(np.concatenate([chunk['y'] for chunk in res]), x**2)
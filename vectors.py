@@ -5,6 +5,8 @@ from expression import *
 from evaluation import  *
 from derivatives import *
 from parsing import *
+from forward import calc_jacobian
+from reverse import sweep
 
 
 class vect:
@@ -75,6 +77,59 @@ class matrix:
         s += ']]'
         return s
 
+class sparse_matrix:
+    '''
+    Numerical matrix in compressed sparse row (CSR) format,
+    only the entries that are not structurally zero are stored:
+    data    -- the values, row by row
+    indices -- the column of each value
+    indptr  -- row i has the values data[indptr[i]:indptr[i+1]]
+    shape   -- (number of rows, number of columns)
+    The arrays are the same as for scipy.sparse.csr_matrix, see to_scipy().
+    For a Jacobian at several points (see sparse_jacobian) data has the shape
+    (number of stored entries,) + shape of the points, i.e. one matrix per point
+    with a common sparsity pattern.
+    '''
+    def __init__(self, data, indices, indptr, shape: tuple):
+        self.data = np.asarray(data)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.indptr = np.asarray(indptr, dtype=np.int32)
+        self.shape = tuple(shape)
+
+    @property
+    def nnz(self) -> int:
+        return len(self.indices)
+
+    def toarray(self) -> np.ndarray:
+        '''
+        The full matrix as ndarray, with zeros for the entries that are not stored.
+        At several points the shape is (shape of the points) + (rows, columns),
+        the same as for vect_jacobian.
+        '''
+        res = np.zeros(self.shape + self.data.shape[1:])
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        res[rows, self.indices] = self.data
+        return np.moveaxis(res, (0, 1), (-2, -1))
+
+    def to_scipy(self):
+        '''
+        Converts to scipy.sparse.csr_matrix, needs scipy.
+        Only for a matrix at a single point, scipy has no batches of matrices.
+        '''
+        if self.data.ndim != 1:
+            raise Exception(f'to_scipy needs a matrix at a single point, the data has the shape {self.data.shape}.')
+        try:
+            from scipy.sparse import csr_matrix
+        except ImportError:
+            raise Exception('to_scipy needs scipy, which is not installed.')
+        return csr_matrix((self.data, self.indices, self.indptr), shape=self.shape)
+
+    def __str__(self):
+        return f'sparse_matrix({self.shape[0]}x{self.shape[1]}, {self.nnz} stored entries)'
+
+    def __repr__(self):
+        return self.__str__()
+
 ################################ vector operations ############################################
 def vect_add(v1: vect, v2: vect) -> vect:
     '''
@@ -130,19 +185,33 @@ def vect_dot_prod(v1: vect, v2: vect) -> myexpr:
 def vect_eval(v: vect, vals: dict) -> vect:
     '''
     Evaluates vector w.r.t. given dict of vars and corr. values.
+    Uses calc_partial_eval, so the components are myexpr,
+    constants if all variables are given.
+    Constant components are written as floats, e.g. 0 -> 0.0.
     '''
     res_v = vect(v.dim)
     for el in v.components:
-        val = calc_eval(el,vals)
-        if isinstance(val,float):
-            res_v.add_comp(myexpr('const',f'{val}'))
-        else:
-            #since calc_eval returns a string if the expr
-            #contains a variable that's not eval'd
-            #the output must be parsed back into myexpr
-            res_v.add_comp(my_parser(list(vals.keys()),val))
+        res = calc_partial_eval(el,vals)
+        if res.op == 'const':
+            res = myexpr('const', f'{float(res.left)}')
+        res_v.add_comp(res)
     return res_v
 
+def vect_eval_array(v: vect, vals: dict) -> np.ndarray:
+    '''
+    Numerical evaluation of a vector at arrays of points, e.g. a meshgrid,
+    vals = {'variable': array} as for calc_eval_array.
+    Every component is evaluated in one vectorized pass, subterms shared
+    between the components are evaluated once.
+    Returns an ndarray of shape (dim,) + shape of the points.
+    '''
+    arrays, shape = as_arrays(vals)
+    res = np.empty((v.dim,) + shape)
+    memo = {}
+    for i, el in enumerate(v.components):
+        res[i] = array_eval(el, arrays, memo)
+    return res
+
 ############################# matrix operations #############################
 def mat_add(m1: matrix, m2: matrix) -> matrix:
     '''
@@ -234,28 +303,109 @@ def mat_eval(m: matrix, vals: dict) -> matrix:
     return res_mat
 
 ############################ vector calculus ################################
-def vect_diff(v: vect, var: str) -> vect:
+def vect_diff(v: vect, var: str, simplify: bool = False) -> vect:
     '''
     differentiates a vector component-wise w.r.t. the given variable
     aka vector-by-scalar derivative
+    simplify is passed on to calc_diff
+    The components share one memo, so subterms common to several
+    components are differentiated once.
     '''
     res_v = vect(v.dim)
+    memo = {}
     for el in v.components:
-        res_v.add_comp(calc_diff(el,var))
+        res_v.add_comp(calc_diff(el,var,memo,simplify))
     return res_v
 
-def vect_grad(term: myexpr, vars: list) -> vect:
+def vect_grad(term: myexpr, vars: list, simplify: bool = False) -> vect:
     '''
     Gradient of scalar function f: R^n -> R.
     All variables have to be provided in the vars list.
+    simplify is passed on to calc_diff
     '''
     dim = len(vars)
     res_v = vect(dim)
     for i in range(dim):
-        res_v.add_comp(calc_diff(term,vars[i]))
+        res_v.add_comp(calc_diff(term,vars[i],simplify=simplify))
     return res_v
 
-def mat_diff(m: matrix, var: str) -> matrix:
+def vect_jacobian(v: vect, vars: list, points: dict = None, simplify: bool = False):
+    '''
+    Jacobian of a vector field f: R^n -> R^m, i.e. the m x n matrix
+    with the entries d(component i)/d(vars[j]).
+    All variables have to be provided in the vars list.
+    Returns a matrix, whose j-th column is vect_diff(v, vars[j]),
+    simplify is passed on to calc_diff.
+
+    If points = {'variable': array} is given, the Jacobian is evaluated numerically
+    at the points instead, with forward mode (see calc_jacobian in forward.py),
+    so no symbolic derivative is built. Returns an ndarray of shape
+    (number of points, m, n), or in general (shape of the points) + (m, n).
+    '''
+    if points is not None:
+        jac = calc_jacobian(v.components, vars, points)
+        return np.moveaxis(jac, (0, 1), (-2, -1))
+    res_mat = matrix(v.dim,len(vars),[])
+    for var in vars:
+        res_mat.columns.append(vect_diff(v,var,simplify))
+    return res_mat
+
+def sparse_jacobian(v: vect, vars: list, point: dict) -> sparse_matrix:
+    '''
+    Numerical Jacobian of a vector field at a point as sparse_matrix.
+    The sparsity pattern follows from the variables each component
+    depends on (see calc_vars in expression.py), only these entries are
+    computed, one backward sweep per component (see sweep in reverse.py)
+    w.r.t. its own variables. Zeros are neither differentiated nor evaluated.
+    The values of the nodes are shared between the components.
+    point is a dict {'variable': value}, with arrays of points the data
+    has the shape (number of stored entries,) + shape of the points
+    and toarray() gives (shape of the points) + (m, n) as vect_jacobian.
+    '''
+    arrays, shape = as_arrays(point)
+    column = {var: j for j, var in enumerate(vars)}
+    values = {}
+    data = []
+    indices = []
+    indptr = [0]
+    for el in v.components:
+        cols = sorted(column[var] for var in calc_vars(el) if var in column)
+        if cols:
+            grads = sweep(el, [vars[j] for j in cols], arrays, values)[1]
+            data.extend(np.broadcast_to(grads[vars[j]], shape) for j in cols)
+            indices.extend(cols)
+        indptr.append(len(indices))
+    data = np.array(data) if data else np.empty((0,) + shape)
+    return sparse_matrix(data, indices, indptr, (v.dim, len(vars)))
+
+def hessian(term: myexpr, vars: list, simplify: bool = False) -> matrix:
+    '''
+    Hessian of scalar function f: R^n -> R, the n x n matrix of the
+    second derivatives d^2 f/(d vars[i] d vars[j]).
+    All variables have to be provided in the vars list.
+    Each first derivative is computed once and only the upper triangle j >= i
+    is differentiated, the lower triangle holds the same terms (symmetry).
+    simplify is passed on to calc_diff.
+    For Hessian-vector products at points see hvp in reverse.py.
+    '''
+    dim = len(vars)
+    first = [calc_diff(term,var,simplify=simplify) for var in vars]
+    #one memo per variable, shared by all first derivatives
+    memos = [{} for _ in vars]
+    entries = [[None]*dim for _ in vars]
+    for i in range(dim):
+        for j in range(i,dim):
+            entries[i][j] = calc_diff(first[i],vars[j],memos[j],simplify)
+            entries[j][i] = entries[i][j]
+    res_mat = matrix(dim,dim,[])
+    for j in range(dim):
+        col = vect(dim)
+        for i in range(dim):
+            col.add_comp(entries[i][j])
+        res_mat.columns.append(col)
+    return res_mat
+
+def mat_diff(m: matrix, var: str, simplify: bool = False) -> matrix:
     '''
     Component-wise derivative of matrix by scalar.
     Uses vect_diff().
@@ -263,6 +413,6 @@ def mat_diff(m: matrix, var: str) -> matrix:
     res_mat = matrix(m.col_dim,m.row_dim,[])
 
     for col in m.columns:
-        res_mat.columns.append(vect_diff(col,var))
+        res_mat.columns.append(vect_diff(col,var,simplify))
     
     return res_mat